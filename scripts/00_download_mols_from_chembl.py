@@ -1,22 +1,25 @@
-from chembl_webresource_client.new_client import new_client
-from tqdm import tqdm
-import gzip
 import argparse
 
+from sdf_io import BlockCompressedWriter, add_writer_arguments
+
 
 def main():
     """
     Filters the molecules of the Chembl database
     by the specified criteria
     (e.g. max number of rule of five violation = 1)
-    and save them in a gzipped sdf file.
+    and save them in a gzipped (or zstd compressed) sdf file.
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument("--output", help="output filename, type: .sdf.gz")
+    parser.add_argument("--output", help="output filename, type: .sdf.gz or .sdf.zst")
+    add_writer_arguments(parser)
     args = parser.parse_args()
 
     print("outputfile:", args.output)
 
+    from chembl_webresource_client.new_client import new_client
+    from tqdm import tqdm
+
     molecule = new_client.molecule
 
     # Filters for chembl query are set here
@@ -25,11 +28,14 @@ def main():
     )
     print(len(mols))
 
-    with gzip.open(args.output, "wb+") as output:
+    with BlockCompressedWriter(
+        args.output, args.codec, args.level, args.threads
+    ) as output:
         for mol in tqdm(mols):
             if mol["molecule_structures"]:
                 output.write(mol["molecule_structures"]["molfile"].encode())
                 output.write(b"$$$$\n")
+                output.end_record()
 
 
 if __name__ == "__main__":
@@ -1,75 +1,94 @@
 import argparse
-import gzip
-from rdkit import Chem
-import tqdm
-from rdkit import RDLogger
-from rdkit.Chem.MolStandardize import rdMolStandardize
+
+from fingerprints import DEFAULT_NBITS, DEFAULT_RADIUS, FingerprintIndex, morgan_fingerprints
+from sdf_io import SDFWriter, add_writer_arguments, open_sdf_input
 
 
 def main():
     """
     takes sdf file of initial training molecules and
-    sdf file of training molecules (both optionally gzipped)
+    sdf file of training molecules (both optionally gzip or zstd compressed)
     and returns only those initial training molecules
     not contained in the training molecules file as sdf file.
+    With --similarity training molecules with a Tanimoto similarity (Morgan fingerprints)
+    above the threshold to any of the filter molecules are removed as well.
     """
-    RDLogger.DisableLog("rdApp.*")
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", help="input filename, type: .sdf.gz or .sdf")
     parser.add_argument("--filter", help="filter filename, type: .sdf or .sdf.gz")
-    parser.add_argument("--output", help="output filename, type: .sdf.gz or .sdf")
+    parser.add_argument(
+        "--output", help="output filename, type: .sdf.gz, .sdf.zst or .sdf"
+    )
+    parser.add_argument(
+        "--similarity",
+        type=float,
+        default=0.0,
+        help="also remove molecules with a Tanimoto similarity >= this threshold to any filter molecule (default: off)",
+    )
+    parser.add_argument(
+        "--fp-radius",
+        type=int,
+        default=DEFAULT_RADIUS,
+        help=f"Morgan fingerprint radius (default={DEFAULT_RADIUS})",
+    )
+    parser.add_argument(
+        "--fp-bits",
+        type=int,
+        default=DEFAULT_NBITS,
+        help=f"Morgan fingerprint size (default={DEFAULT_NBITS})",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=4096,
+        help="molecules compared at once in similarity mode (default=4096)",
+    )
+    add_writer_arguments(parser)
     args = parser.parse_args()
-    input_zipped = False
+
+    from rdkit import Chem, RDLogger
+
+    RDLogger.DisableLog("rdApp.*")
     print("inputfile:", args.input)
     print("outputfile:", args.output)
     ini_list = []
     smi_list = []
+    fp_mols = []
     # start with generating INCHI and SMILES for mols in the filter set
     for i in args.filter.split(","):
-        # test if it's gzipped
-        with gzip.open(i, "r") as fh:
-            try:
-                fh.read(1)
-                input_zipped = True
-            except gzip.BadGzipFile:
-                input_zipped = False
-
-        if input_zipped:
-            with gzip.open(i, "r") as fh:
-                suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-                ini_list.extend(ini_filter(suppl))
-            with gzip.open(i, "r") as fh:
-                suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-                smi_list.extend(smi_filter(suppl))
-        else:
-            with open(i, "rb") as fh:
-                suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-                ini_list.extend(ini_filter(suppl))
-            with open(i, "rb") as fh:
+        with open_sdf_input(i) as fh:
+            suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
+            ini_list.extend(ini_filter(suppl))
+        with open_sdf_input(i) as fh:
+            suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
+            smi_list.extend(smi_filter(suppl))
+        if args.similarity:
+            with open_sdf_input(i) as fh:
                 suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-                smi_list.extend(smi_filter(suppl))
+                fp_mols.extend(fp_filter(suppl))
 
     print(f"{len(ini_list)} inchi test molecules found")
     print(f"{len(smi_list)} smi test molecules found")
-    # test if it's gzipped
-    with gzip.open(args.input, "r") as fh:
-        try:
-            fh.read(1)
-            input_zipped = True
-        except gzip.BadGzipFile:
-            input_zipped = False
-
-    if input_zipped:
-        with gzip.open(args.input, "r") as fh:
-            suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-            processing(suppl, args, ini_list, smi_list)
-    else:
-        with open(args.input, "rb") as fh:
-            suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-            processing(suppl, args, ini_list, smi_list)
+    # sets make the lookup for every training molecule O(1)
+    ini_list = set(ini_list)
+    smi_list = set(smi_list)
+    fp_index = None
+    if args.similarity:
+        fp_index = FingerprintIndex(
+            morgan_fingerprints(fp_mols, args.fp_radius, args.fp_bits)
+        )
+        print(
+            f"{len(fp_index)} fingerprints of test molecules, similarity threshold: {args.similarity}"
+        )
+    with open_sdf_input(args.input) as fh:
+        suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
+        processing(suppl, args, ini_list, smi_list, fp_index)
 
 
 def smi_filter(suppl):
+    from rdkit import Chem
+    from rdkit.Chem.MolStandardize import rdMolStandardize
+
     un = rdMolStandardize.Uncharger()
     smi_list = []
     # SMILES are generated
@@ -81,6 +100,9 @@ def smi_filter(suppl):
 
 
 def ini_filter(suppl):
+    from rdkit import Chem
+    from rdkit.Chem.MolStandardize import rdMolStandardize
+
     un = rdMolStandardize.Uncharger()
     ini_list = []
     # InCHIs are generated
@@ -91,35 +113,85 @@ def ini_filter(suppl):
     return ini_list
 
 
-def processing(suppl, args, exclude_ini_list, exclude_smi_list):
+def fp_filter(suppl):
+    from rdkit.Chem.MolStandardize import rdMolStandardize
+
+    un = rdMolStandardize.Uncharger()
+    mol_list = []
+    # neutralized mols for the fingerprints
+    for mol in suppl:
+        mol_list.append(un.uncharge(mol))
+    return mol_list
+
+
+def similarity_filter(chunk, writer, args, fp_index):
+    """
+    writes the mols of chunk (list of (mol, uncharged mol) tuples)
+    that are less similar than the threshold to every filter molecule.
+    returns the number of written and similar mols.
+    """
+    fps = morgan_fingerprints([m for _, m in chunk], args.fp_radius, args.fp_bits)
+    max_sim, _ = fp_index.max_similarity(fps, args.similarity)
+    written = 0
+    for (mol, _), sim in zip(chunk, max_sim):
+        if sim < args.similarity:
+            written += 1
+            writer.write(mol)
+    return written, len(chunk) - written
+
+
+def processing(suppl, args, exclude_ini_list, exclude_smi_list, fp_index=None):
+    import tqdm
+    from rdkit import Chem
+    from rdkit.Chem.MolStandardize import rdMolStandardize
+
     dup = 0
+    similar = 0
     skipped = 0
     written = 0
+    # mols that passed the exact filter and wait for the similarity filter
+    chunk = []
     # iterate through dataset for which molecules are filtered
     un = rdMolStandardize.Uncharger()
-    with gzip.open(args.output, "wt+") as sdf_zip:
-        with Chem.SDWriter(sdf_zip) as writer:
-            for idx, mol in enumerate(tqdm.tqdm(suppl)):
-                if mol:
-                    # uncharge
-                    mol_uncharged = un.uncharge(mol)
-                    smiles = Chem.MolToSmiles(mol_uncharged)
-                    try:
-                        inchi = Chem.inchi.MolToInchi(mol_uncharged)
-                    except Chem.rdchem.KekulizeException:
-                        print(smiles)
-                    # test if either an inchi or a smiles are in the exclude lists
-                    if inchi in exclude_ini_list or smiles in exclude_smi_list:
-                        dup += 1
-                    else:
-                        # if not write mol to filtered data set
-                        written += 1
-                        writer.write(mol)
-
+    with SDFWriter(args.output, args.codec, args.level, args.threads) as writer:
+        for idx, mol in enumerate(tqdm.tqdm(suppl)):
+            if mol:
+                # uncharge
+                mol_uncharged = un.uncharge(mol)
+                smiles = Chem.MolToSmiles(mol_uncharged)
+                try:
+                    inchi = Chem.inchi.MolToInchi(mol_uncharged)
+                except Chem.rdchem.KekulizeException:
+                    print(smiles)
+                # test if either an inchi or a smiles are in the exclude lists
+                if inchi in exclude_ini_list or smiles in exclude_smi_list:
+                    dup += 1
+                elif fp_index is not None:
+                    # similarity is tested for a chunk of mols at once
+                    chunk.append((mol, mol_uncharged))
+                    if len(chunk) >= args.chunk_size:
+                        w, s = similarity_filter(chunk, writer, args, fp_index)
+                        written += w
+                        similar += s
+                        chunk = []
                 else:
-                    skipped += 1
+                    # if not write mol to filtered data set
+                    written += 1
+                    writer.write(mol)
+
+            else:
+                skipped += 1
+
+        if chunk:
+            w, s = similarity_filter(chunk, writer, args, fp_index)
+            written += w
+            similar += s
 
     print(f"{dup} duplicate molecules found and discarted")
+    if fp_index is not None:
+        print(
+            f"{similar} molecules with similarity >= {args.similarity} to test molecules discarted"
+        )
     print(f"{skipped} molecules skipped")
     print(f"{written} molecules")
 
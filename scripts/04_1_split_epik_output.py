@@ -1,14 +1,9 @@
-from rdkit import Chem
-from pkasolver.data import iterate_over_acids, iterate_over_bases
-
 import argparse
-import gzip
-from molvs import Standardizer
 from copy import deepcopy
-import pickle
-
 
-s = Standardizer()
+from mol_store import save_intermediate
+from sdf_io import open_sdf_input
+from pair_dedup import DEDUP_POLICIES, PairIndex, merge_entries
 
 PH = 7.4
 
@@ -18,38 +13,50 @@ def main():
     takes sdf file with molcules containing epik pka predictions in their properties
     and outputs a pkl file in which pairs of molecules are deposited
     that describe the protonated and deprotonated species for each pka value.
+    Identical pairs (same canonical SMILES and reaction center) from different
+    chembl ids are resolved with the --dedup policy and logged to --report.
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", help="input filename, type: .sdf.gz or .sdf")
-    parser.add_argument("--output", help="output filename, type: .pkl")
+    parser.add_argument("--input", help="input filename, type: .sdf.gz, .sdf.zst or .sdf")
+    parser.add_argument(
+        "--output", help="output filename, type: .pkl or directory for a mol store"
+    )
+    parser.add_argument(
+        "--dedup",
+        default="keep-first",
+        choices=DEDUP_POLICIES,
+        help="how identical pairs are resolved (default=keep-first)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="pKa difference above which identical pairs are conflicting (default=0.5)",
+    )
+    parser.add_argument(
+        "--report",
+        default="",
+        help="deduplication report filename, type: .tsv (default: <output>.dedup.tsv)",
+    )
     args = parser.parse_args()
-    input_zipped = False
     print(f"pH splitting used: {PH}")
     print("inputfile:", args.input)
     print("outputfile:", args.output)
 
-    #  test if it's gzipped
-    with gzip.open(args.input, "r") as fh:
-        try:
-            fh.read(1)
-            input_zipped = True
-        except gzip.BadGzipFile:
-            input_zipped = False
+    from rdkit import Chem
 
-    if input_zipped:
-        with gzip.open(args.input, "r") as fh:
-            suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-            processing(suppl, args)
-    else:
-        with open(args.input, "rb") as fh:
-            suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-            processing(suppl, args)
+    with open_sdf_input(args.input) as fh:
+        suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
+        processing(suppl, args)
 
 
 def processing(suppl, args):
+    from pkasolver.data import iterate_over_acids, iterate_over_bases
+
     GLOBAL_COUNTER = 0
     nr_of_skipped_mols = 0
     all_protonation_states_enumerated = dict()
+    pair_index = PairIndex(args.dedup, args.tolerance)
 
     # iterating through mols
     for nr_of_mols, mol in enumerate(suppl):
@@ -208,20 +215,37 @@ def processing(suppl, args):
                     f"{counter=}, {pka=}, {mol2.GetProp('mol-smiles')}, deprot, {mol1.GetProp('epik_atom')}"
                 )
             print(pka_list)
-            if chembl_id in all_protonation_states_enumerated.keys():
-                raise RuntimeError("Repeated chembl id!")
-
-            all_protonation_states_enumerated[chembl_id] = {
+            entry = {
                 "mols": combined_mols,
                 "pKa_list": pka_list,
                 "smiles_list": smiles_list,
                 "counter_list": counter_list,
             }
+            if chembl_id in all_protonation_states_enumerated.keys():
+                # repeated chembl ids are merged, duplicated pairs are removed below
+                print(f"Repeated chembl id: {chembl_id}")
+                pair_index.report_repeated_chembl_id(chembl_id, entry)
+                entry = merge_entries(all_protonation_states_enumerated[chembl_id], entry)
+
+            all_protonation_states_enumerated[chembl_id] = entry
 
     print(f"finished splitting {nr_of_mols} molecules")
     print(f"skipped mols: {nr_of_skipped_mols}")
+    nr_of_pairs = sum(len(e["mols"]) for e in all_protonation_states_enumerated.values())
+    all_protonation_states_enumerated = pair_index.deduplicate(
+        all_protonation_states_enumerated
+    )
+    nr_of_unique_pairs = sum(
+        len(e["mols"]) for e in all_protonation_states_enumerated.values()
+    )
+    report = args.report or f"{args.output}.dedup.tsv"
+    pair_index.write_report(report)
+    print(
+        f"deduplication ({args.dedup}): {nr_of_pairs} pairs, {nr_of_unique_pairs} kept, "
+        f"{len(pair_index.report)} issues written to {report}"
+    )
     # save everything
-    pickle.dump(all_protonation_states_enumerated, open(args.output, "wb+"))
+    save_intermediate(all_protonation_states_enumerated, args.output)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,8 @@
-from rdkit import Chem
-from pkasolver.data import iterate_over_acids, iterate_over_bases
 import argparse
-import gzip
-from molvs import Standardizer
 from copy import deepcopy
-import pickle
 
-s = Standardizer()
+from mol_store import save_intermediate
+from sdf_io import open_sdf_input
 
 PH = 7.4
 
@@ -17,33 +13,26 @@ def main():
     ?Precise purpose?
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", help="input filename, type: .sdf.gz or .sdf")
-    parser.add_argument("--output", help="output filename, type: .pkl")
+    parser.add_argument("--input", help="input filename, type: .sdf.gz, .sdf.zst or .sdf")
+    parser.add_argument(
+        "--output", help="output filename, type: .pkl or directory for a mol store"
+    )
     args = parser.parse_args()
-    input_zipped = False
     print(f"pH splitting used: {PH}")
     print("inputfile:", args.input)
     print("outputfile:", args.output)
 
-    # test if it's gzipped
-    with gzip.open(args.input, "r") as fh:
-        try:
-            fh.read(1)
-            input_zipped = True
-        except gzip.BadGzipFile:
-            input_zipped = False
+    from rdkit import Chem
 
-    if input_zipped:
-        with gzip.open(args.input, "r") as fh:
-            suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-            processing(suppl, args)
-    else:
-        with open(args.input, "rb") as fh:
-            suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
-            processing(suppl, args)
+    with open_sdf_input(args.input) as fh:
+        suppl = Chem.ForwardSDMolSupplier(fh, removeHs=True)
+        processing(suppl, args)
 
 
 def processing(suppl, args):
+    from rdkit import Chem
+    from pkasolver.data import iterate_over_acids, iterate_over_bases
+
     GLOBAL_COUNTER = 0
     nr_of_skipped_mols = 0
     all_protonation_states_enumerated = dict()
@@ -197,7 +186,7 @@ def processing(suppl, args):
 
     print(f"finished splitting {nr_of_mols} molecules")
     print(f"skipped mols: {nr_of_skipped_mols}")
-    pickle.dump(all_protonation_states_enumerated, open(args.output, "wb+"))
+    save_intermediate(all_protonation_states_enumerated, args.output)
 
 
 if __name__ == "__main__":
@@ -1,108 +1,289 @@
 import argparse
+import os
 import pickle
-import torch
-from pkasolver.constants import EDGE_FEATURES, NODE_FEATURES
-from pkasolver.data import (
-    make_features_dicts,
-    mol_to_paired_mol_data,
-)
-from itertools import repeat
-import multiprocess as mp
-from pkasolver.query import _sort_conj
-
-
-def main(selected_node_features: dict, selected_edge_features: dict):
+import shutil
+import tempfile
+
+from featurize import FEATURIZERS
+from mol_store import MolStore, record_to_mols, write_mol_store
+
+# selection of node and edge features
+node_feat_list = [
+    "element",
+    "formal_charge",
+    "hybridization",
+    "total_num_Hs",
+    "aromatic_tag",
+    "total_valence",
+    "total_degree",
+    "is_in_ring",
+    "reaction_center",
+    "smarts",
+]
+
+edge_feat_list = ["bond_type", "is_conjugated", "rotatable"]
+
+# set once per worker process by init_worker
+worker_store = None
+worker_shard_dir = None
+worker_node_features = None
+worker_edge_features = None
+worker_featurizer = None
+
+
+def init_worker(
+    store_path: str,
+    shard_dir: str,
+    selected_node_features: dict,
+    selected_edge_features: dict,
+    featurizer: str = "batched",
+):
     """
-    takes pkl file of molecules containing pka data and returns
+    opens the (memory-mapped) mol store and keeps the feature selection in the worker,
+    so tasks only need to contain entry indices.
+    """
+    global worker_store, worker_shard_dir, worker_node_features, worker_edge_features
+    global worker_featurizer
+    from featurize import BatchFeaturizer
+
+    worker_store = MolStore(store_path)
+    worker_shard_dir = shard_dir
+    worker_node_features = selected_node_features
+    worker_edge_features = selected_edge_features
+    if featurizer == "batched":
+        worker_featurizer = BatchFeaturizer(
+            selected_node_features, selected_edge_features
+        )
+
+
+def process_entries(entry_range: tuple) -> tuple:
+    """
+    processes the mol store entries in [start, stop) and writes the pickled PairData
+    objects to a pair store shard. Returns the shard path and the number of pairs.
+    """
+    from pair_store import PairStoreWriter
+
+    start, stop = entry_range
+    shard = os.path.join(worker_shard_dir, f"{start:012d}")
+    nr_of_pairs = 0
+    # all pairs of the task are featurized as one batch
+    records = []
+    for entry_idx in range(start, stop):
+        records.extend(worker_store.get_entry_records(entry_idx))
+    with PairStoreWriter(shard) as writer:
+        for pair in processing(
+            records, worker_node_features, worker_edge_features, worker_featurizer
+        ):
+            writer.append(pair)
+            nr_of_pairs += 1
+    return shard, nr_of_pairs
+
+
+def main():
+    """
+    takes pkl file or mol store of molecules containing pka data and returns
     pytorch geometric graph data containing
-    protonated and deprotonated graphs for every pka
+    protonated and deprotonated graphs for every pka.
+    Workers read the molecules from a memory-mapped mol store and return
+    the graphs through pair store shards in a temporary directory.
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input", help="input filename, type: .pkl")
-    parser.add_argument("--output", help="output filename, type: .pkl")
+    parser.add_argument("--input", help="input filename, type: .pkl or mol store")
+    parser.add_argument(
+        "--output", help="output filename, type: .pkl or directory for a pair store"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="number of worker processes (default=4)"
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100,
+        help="chembl id entries per worker task (default=100)",
+    )
+    parser.add_argument(
+        "--featurizer",
+        default="batched",
+        choices=FEATURIZERS,
+        help="batched: featurize all pairs of a task at once, "
+        "reference: pkasolver.data.mol_to_paired_mol_data for every pair (default=batched)",
+    )
+    parser.add_argument(
+        "--verify",
+        type=int,
+        default=100,
+        help="number of pairs on which the batched featurizer is compared "
+        "with the reference before processing (default=100, 0: no check)",
+    )
+    parser.add_argument(
+        "--tmpdir",
+        default="",
+        help="directory for the converted input and the worker shards "
+        "(default: directory of the output), e.g. /dev/shm if it is large enough",
+    )
     args = parser.parse_args()
     print("inputfile:", args.input)
     print("outputfile:", args.output)
+
+    # torch and pkasolver are only imported once the arguments are parsed
+    import multiprocess as mp
+    from pkasolver.constants import EDGE_FEATURES, NODE_FEATURES
+    from pkasolver.data import make_features_dicts
+
+    from pair_store import PairStore, PairStoreWriter
+
+    # make dicts from selection list to be used in the processing step
+    selected_node_features = make_features_dicts(NODE_FEATURES, node_feat_list)
+    selected_edge_features = make_features_dicts(EDGE_FEATURES, edge_feat_list)
     print("Start processing data...")
-    pair_data_list = []
-    pool = mp.Pool(4)
-    # test if it's gzipped
-    with open(args.input, "rb") as fh:
-        suppl = pickle.load(fh)
-        print(len(suppl))
-        pair_data_list.extend(
-            pool.starmap(
-                processing,
-                zip(
-                    suppl.values(),
-                    repeat(selected_node_features),
-                    repeat(selected_edge_features),
-                ),
-                chunksize=100,
+
+    # on disk by default: /dev/shm is often small (64 MB in docker containers) and the shards
+    # would stay in RAM next to the output, the page cache is shared with the workers anyway
+    tmp_dir = tempfile.mkdtemp(
+        prefix="05_data_preprocess_",
+        dir=args.tmpdir or os.path.dirname(os.path.abspath(args.output)),
+    )
+    try:
+        if os.path.isdir(args.input):
+            store_path = args.input
+        else:
+            # legacy pkl input is converted once so that workers can read it by index
+            with open(args.input, "rb") as fh:
+                suppl = pickle.load(fh)
+            store_path = os.path.join(tmp_dir, "input.mols")
+            write_mol_store(suppl, store_path)
+            del suppl
+        nr_of_entries = MolStore(store_path).nr_of_entries
+        print(nr_of_entries)
+        if args.featurizer == "batched" and args.verify > 0:
+            check_featurizer(
+                MolStore(store_path),
+                args.verify,
+                selected_node_features,
+                selected_edge_features,
             )
-        )
 
-    flat_pair_data_list = [item for sublist in pair_data_list for item in sublist]
-    del pair_data_list
-    print(
-        f"PairData objects of {len(flat_pair_data_list)} molecules successfully saved!"
+        shard_dir = os.path.join(tmp_dir, "shards")
+        os.makedirs(shard_dir)
+        entry_ranges = [
+            (start, min(start + args.chunksize, nr_of_entries))
+            for start in range(0, nr_of_entries, args.chunksize)
+        ]
+        with mp.Pool(
+            args.workers,
+            initializer=init_worker,
+            initargs=(
+                store_path,
+                shard_dir,
+                selected_node_features,
+                selected_edge_features,
+                args.featurizer,
+            ),
+        ) as pool:
+            shards = pool.map(process_entries, entry_ranges)
+
+        nr_of_pairs = sum(n for _, n in shards)
+        if args.output.endswith(".pkl"):
+            flat_pair_data_list = []
+            for shard, _ in shards:
+                flat_pair_data_list.extend(PairStore(shard))
+            with open(args.output, "wb") as f:
+                pickle.dump(flat_pair_data_list, f)
+        else:
+            # the pickled objects are copied without unpickling them
+            with PairStoreWriter(args.output) as writer:
+                for shard, _ in shards:
+                    shard_store = PairStore(shard)
+                    for idx in range(len(shard_store)):
+                        writer.append_bytes(shard_store.get_bytes(idx))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"PairData objects of {nr_of_pairs} molecules successfully saved!")
+
+
+def check_featurizer(
+    store: MolStore,
+    nr_of_pairs: int,
+    selected_node_features: dict,
+    selected_edge_features: dict,
+):
+    """
+    compares the batched featurizer with pkasolver.data.mol_to_paired_mol_data
+    on the first nr_of_pairs pairs of the mol store, the graphs have to be bit-identical.
+    """
+    from featurize import BatchFeaturizer, verify_featurizer
+
+    records = [store.get_record(idx) for idx in range(min(nr_of_pairs, len(store)))]
+    pairs, _ = sort_pairs(records)
+    mismatches = verify_featurizer(
+        BatchFeaturizer(selected_node_features, selected_edge_features), pairs
     )
-    with open(args.output, "wb") as f:
-        pickle.dump(flat_pair_data_list, f)
+    if mismatches:
+        i, differences = mismatches[0]
+        raise RuntimeError(
+            f"batched featurizer differs from pkasolver in {len(mismatches)} of {len(pairs)} pairs "
+            f"(first: pair {i}, {differences}), use --featurizer reference"
+        )
+    print(f"batched featurizer verified on {len(pairs)} pairs")
 
 
-def processing(
-    entry, selected_node_features: dict, selected_edge_features: dict
-) -> list:
+def sort_pairs(records: list) -> tuple:
+    """
+    turns mol store records into (protonated mol, deprotonated mol, reaction center) tuples
+    and returns them with the mols in their original order (for the properties).
+    """
+    from pkasolver.query import _sort_conj
 
-    combined_mols = entry["mols"]
-    pka_list = entry["pKa_list"]
+    mol_pairs = [record_to_mols(record) for record in records]
     pairs = []
-    for mol_pair, pka_value in zip(combined_mols, pka_list):
-        chembl_id = mol_pair[0].GetProp("CHEMBL_ID")
-        internal_id1 = mol_pair[0].GetProp("INTERNAL_ID")
-        internal_id2 = mol_pair[1].GetProp("INTERNAL_ID")
-        smiles_prop = mol_pair[0].GetProp("mol-smiles")
-        smiles_deprop = mol_pair[1].GetProp("mol-smiles")
+    for mol_pair, _ in mol_pairs:
         atom_idx = mol_pair[0].GetProp("epik_atom")
-        mol_pair = _sort_conj(mol_pair)
-        m = mol_to_paired_mol_data(
-            mol_pair[0],
-            mol_pair[1],
-            atom_idx,
-            selected_node_features,
-            selected_edge_features,
-        )
+        sorted_pair = _sort_conj(mol_pair)
+        pairs.append((sorted_pair[0], sorted_pair[1], atom_idx))
+    return pairs, mol_pairs
+
+
+def processing(
+    entry,
+    selected_node_features: dict,
+    selected_edge_features: dict,
+    featurizer=None,
+) -> list:
+    """
+    returns the PairData objects of mol store records, featurized as one batch by featurizer
+    (a featurize.BatchFeaturizer) or pair by pair with mol_to_paired_mol_data if featurizer is None.
+    """
+    import torch
+    from pkasolver.data import mol_to_paired_mol_data
 
+    # records of a mol store
+    pairs, mol_pairs = sort_pairs(entry)
+    if featurizer is not None:
+        data = featurizer.featurize(pairs)
+    else:
+        data = [
+            mol_to_paired_mol_data(
+                mol_prot,
+                mol_deprot,
+                atom_idx,
+                selected_node_features,
+                selected_edge_features,
+            )
+            for mol_prot, mol_deprot, atom_idx in pairs
+        ]
+    for m, (mol_pair, pka_value), (_, _, atom_idx) in zip(data, mol_pairs, pairs):
         m.reference_value = torch.tensor(pka_value, dtype=torch.float32)
-        m.internal_id = (internal_id1, internal_id2)
-        m.smiles_prop = smiles_prop
-        m.smiles_deprop = smiles_deprop
-        m.chembl_id = chembl_id
+        m.internal_id = (
+            mol_pair[0].GetProp("INTERNAL_ID"),
+            mol_pair[1].GetProp("INTERNAL_ID"),
+        )
+        m.smiles_prop = mol_pair[0].GetProp("mol-smiles")
+        m.smiles_deprop = mol_pair[1].GetProp("mol-smiles")
+        m.chembl_id = mol_pair[0].GetProp("CHEMBL_ID")
         m.reaction_center = atom_idx
-        pairs.append(m)
-    return pairs
+    return data
 
 
 if __name__ == "__main__":
-    # define selection of node and edge features
-    node_feat_list = [
-        "element",
-        "formal_charge",
-        "hybridization",
-        "total_num_Hs",
-        "aromatic_tag",
-        "total_valence",
-        "total_degree",
-        "is_in_ring",
-        "reaction_center",
-        "smarts",
-    ]
-
-    edge_feat_list = ["bond_type", "is_conjugated", "rotatable"]
-
-    # make dicts from selection list to be used in the processing step
-    selected_node_features = make_features_dicts(NODE_FEATURES, node_feat_list)
-    selected_edge_features = make_features_dicts(EDGE_FEATURES, edge_feat_list)
-
-    main(selected_node_features, selected_edge_features)
+    main()
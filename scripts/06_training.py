@@ -2,13 +2,10 @@ import argparse
 import os
 import pickle
 import random
+import time
+from copy import deepcopy
 
-import torch
-from pkasolver.constants import DEVICE
-from pkasolver.data import calculate_nr_of_features
-from pkasolver.ml import dataset_to_dataloader
-from pkasolver.ml_architecture import GINPairV1, gcn_full_training
-from sklearn.model_selection import train_test_split
+from dataset_split import SPLIT_METHODS, load_split, save_split, split_indices
 
 # all used node features
 node_feat_list = [
@@ -27,8 +24,121 @@ node_feat_list = [
 # all possible edge features (none are used)
 edge_feat_list = ["bond_type", "is_conjugated", "rotatable"]
 
-num_node_features = calculate_nr_of_features(node_feat_list)
-num_edge_features = calculate_nr_of_features(edge_feat_list)
+
+def parse_cpu_list(cpu_list: str) -> set:
+    """
+    parses a cpu list in taskset notation (e.g. "0-7,16,18-19") into a set of cpu ids.
+    """
+    cpus = set()
+    for part in cpu_list.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, stop = part.split("-")
+            cpus.update(range(int(start), int(stop) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def allowed_cpus() -> list:
+    """
+    returns the sorted ids of the cpus this process is allowed to run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def available_cpus() -> int:
+    """
+    returns the number of cpus this process is allowed to run on.
+    """
+    return len(allowed_cpus())
+
+
+def make_dataloader(
+    dataset: list,
+    batch_size: int,
+    shuffle: bool = True,
+    num_workers: int = 0,
+    prefetch_factor: int = 2,
+):
+    """
+    same as pkasolver.ml.dataset_to_dataloader, but exposes the worker settings
+    of the torch DataLoader. Workers are kept alive between epochs.
+    """
+    from pkasolver.constants import DEVICE
+    from torch_geometric.loader import DataLoader
+
+    worker_kwargs = {}
+    if num_workers > 0:
+        worker_kwargs = dict(
+            persistent_workers=True, prefetch_factor=prefetch_factor
+        )
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        follow_batch=["x_p", "x_d"],
+        num_workers=num_workers,
+        pin_memory=DEVICE.type == "cuda",
+        **worker_kwargs,
+    )
+
+
+def autotune(
+    model, dataset: list, batch_size: int, learning_rate: float, args
+) -> dict:
+    """
+    trains a copy of the model for a few epochs on a subset of the training set
+    with different thread/worker settings and returns the fastest setting.
+    """
+    import torch
+    from pkasolver.constants import DEVICE
+    from pkasolver.ml_architecture import gcn_train
+
+    nr_of_cpus = available_cpus()
+    thread_candidates = sorted(
+        {max(1, nr_of_cpus // d) for d in (1, 2, 4)}, reverse=True
+    )
+    worker_candidates = [w for w in (0, 2, 4) if w < nr_of_cpus]
+    subset = dataset[: args.autotune_batches * batch_size]
+    print(
+        f"Autotuning on {len(subset)} samples for {args.autotune_epochs} epochs per setting"
+    )
+
+    timings = []
+    for num_threads in thread_candidates:
+        for num_workers in worker_candidates:
+            torch.set_num_threads(num_threads)
+            loader = make_dataloader(
+                subset,
+                batch_size,
+                shuffle=True,
+                num_workers=num_workers,
+                prefetch_factor=args.prefetch_factor,
+            )
+            bench_model = deepcopy(model).to(device=DEVICE)
+            optimizer = torch.optim.AdamW(bench_model.parameters(), lr=learning_rate)
+            # first epoch is warm up (worker start, allocator)
+            gcn_train(bench_model, loader, optimizer)
+            start = time.perf_counter()
+            for _ in range(args.autotune_epochs):
+                gcn_train(bench_model, loader, optimizer)
+            elapsed = (time.perf_counter() - start) / args.autotune_epochs
+            print(f"threads: {num_threads}, workers: {num_workers}: {elapsed:.3f}s/epoch")
+            timings.append((elapsed, num_threads, num_workers))
+            del loader, bench_model, optimizer
+
+    _, num_threads, num_workers = min(timings)
+    # the settings are only valid for the cpus they were tuned on
+    return {
+        "num_threads": num_threads,
+        "num_workers": num_workers,
+        "cpus": allowed_cpus(),
+    }
 
 
 def main():
@@ -43,8 +153,16 @@ def main():
     optional parameters:
     --val: set of validation molecules as pyg graphs (pkl)
     --epochs: set number of training epochs (default == 1000)
-    --reg: optional regularization training set (pkl)
+    --reg: optional regularization training set (pkl or pair store)
     -r: flag for retraining model at path give by --path
+    --split: how the validation set is split off (random, chembl_id, scaffold, cluster)
+    --split-file: training/validation indices generated with dataset_split.py
+    --threads: number of intra-op threads used by torch
+    --interop-threads: number of inter-op threads used by torch
+    --workers: number of DataLoader worker processes
+    --prefetch-factor: batches prefetched by each DataLoader worker
+    --cpus: cpus this run is pinned to (e.g. 0-7,16-23)
+    --autotune: benchmark thread/worker settings and use the fastest (tuned again when the allowed cpus change)
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", help="training set path, type: .pkl")
@@ -59,8 +177,91 @@ def main():
         "--reg", nargs="?", default="", help="regularization set filename"
     )
     parser.add_argument("-r", action="store_true", help="retraining run")
+    parser.add_argument(
+        "--split",
+        default="random",
+        choices=SPLIT_METHODS,
+        help="split method for the validation set (default=random)",
+    )
+    parser.add_argument(
+        "--split-threshold",
+        type=float,
+        default=0.6,
+        help="Tanimoto similarity threshold of the cluster split (default=0.6)",
+    )
+    parser.add_argument(
+        "--split-file",
+        default="",
+        help="training/validation indices (.npz) generated with dataset_split.py",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="number of intra-op threads (default: torch default)",
+    )
+    parser.add_argument(
+        "--interop-threads",
+        type=int,
+        default=0,
+        help="number of inter-op threads (default: torch default)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of DataLoader workers (default: 0, or the tuned number with --autotune)",
+    )
+    parser.add_argument(
+        "--prefetch-factor",
+        type=int,
+        default=2,
+        help="batches prefetched per DataLoader worker (default=2)",
+    )
+    parser.add_argument(
+        "--cpus", default="", help="pin the run to these cpus, e.g. 0-7,16-23"
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="benchmark thread and worker settings and use the fastest",
+    )
+    parser.add_argument(
+        "--autotune-epochs",
+        type=int,
+        default=2,
+        help="timed epochs per autotune setting (default=2)",
+    )
+    parser.add_argument(
+        "--autotune-batches",
+        type=int,
+        default=50,
+        help="size of the autotune subset in batches (default=50)",
+    )
     args = parser.parse_args()
 
+    # cpu affinity and inter-op threads have to be set before torch does any parallel work
+    if args.cpus:
+        os.sched_setaffinity(0, parse_cpu_list(args.cpus))
+        print(f"Pinned to cpus: {sorted(os.sched_getaffinity(0))}")
+
+    # torch is only imported once the arguments are parsed and the cpus are pinned
+    import torch
+    from pkasolver.constants import DEVICE
+    from pkasolver.data import calculate_nr_of_features
+    from pkasolver.ml_architecture import GINPairV1, gcn_full_training
+    from torch_geometric.loader import DataLoader
+
+    from pair_store import BatchStream, open_pair_store
+
+    if args.interop_threads:
+        torch.set_num_interop_threads(args.interop_threads)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    elif args.cpus:
+        # do not oversubscribe the pinned cpus
+        torch.set_num_threads(available_cpus())
+
     if args.r:
         BATCH_SIZE = 64
     else:
@@ -102,27 +303,34 @@ def main():
         with open(f"{args.path}/randint.pkl", "wb+") as f:
             pickle.dump(rs, f)
 
-    # randomly split training set in training and validation set
+    # split training set in training and validation set
     print(f"load training dataset from: {args.input}")
-    print(f"random 90:10 split is used to generate validation set.")
+    # reload split indices if present, they are saved per training set
+    split_file = args.split_file or (
+        f"{args.path}/split_{args.split}_{os.path.splitext(os.path.basename(args.input))[0]}.npz"
+    )
+    if os.path.isfile(split_file):
+        train_idx, val_idx = load_split(split_file)
+        print(f"Loading split indices: {split_file}")
+        if len(train_idx) + len(val_idx) != len(train_dataset):
+            raise RuntimeError(
+                f"{split_file} does not match the training set: {len(train_idx) + len(val_idx)} != {len(train_dataset)}"
+            )
+    else:
+        print(f"{args.split} 90:10 split is used to generate validation set.")
+        train_idx, val_idx = split_indices(
+            train_dataset, args.split, rs, test_size=0.1, threshold=args.split_threshold
+        )
+        save_split(split_file, train_idx, val_idx, args.split)
 
     # split dataset
-    train_dataset, validation_dataset = train_test_split(
-        train_dataset, test_size=0.1, shuffle=True, random_state=rs
+    train_dataset, validation_dataset = (
+        [train_dataset[i] for i in train_idx],
+        [train_dataset[i] for i in val_idx],
     )
 
-    train_loader = dataset_to_dataloader(train_dataset, BATCH_SIZE, shuffle=True)
-    val_loader = dataset_to_dataloader(validation_dataset, BATCH_SIZE, shuffle=True)
-
-    # if retraining
-    if args.r:
-        # do we have a regularization dataset
-        with open(args.reg, "rb") as f:
-            reg_dataset = pickle.load(f)
-        reg_loader = dataset_to_dataloader(reg_dataset, 1024, shuffle=True)
-    else:
-        reg_loader = None
-
+    num_node_features = calculate_nr_of_features(node_feat_list)
+    num_edge_features = calculate_nr_of_features(edge_feat_list)
     model = model_class(
         num_node_features, num_edge_features, hidden_channels=hidden_channels
     )
@@ -139,6 +347,69 @@ def main():
         prefix = "pretrained_"
         optimizer = torch.optim.AdamW(model.parameters(), lr=LEARNING_RATE,)
 
+    # reload tuned thread/worker settings if present, otherwise benchmark them
+    if args.autotune and args.threads and args.workers is not None:
+        print("--threads and --workers are given, nothing to autotune")
+    elif args.autotune:
+        tuning_file = f"{args.path}/{prefix}threading.pkl"
+        tuning = None
+        if os.path.isfile(tuning_file):
+            tuning = pickle.load(open(tuning_file, "rb"))
+            # e.g. a restart with other --cpus
+            if tuning.get("cpus") != allowed_cpus():
+                print(f"{tuning_file} was tuned on other cpus, tuning again")
+                tuning = None
+            else:
+                print(f"Loading tuned settings: {tuning}")
+        if tuning is None:
+            tuning = autotune(model, train_dataset, BATCH_SIZE, LEARNING_RATE, args)
+            print(f"Fastest settings: {tuning}")
+            with open(tuning_file, "wb+") as f:
+                pickle.dump(tuning, f)
+        # explicit --threads/--workers win over the tuned values
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        else:
+            torch.set_num_threads(min(tuning["num_threads"], available_cpus()))
+        if args.workers is None:
+            args.workers = tuning["num_workers"]
+    if args.workers is None:
+        args.workers = 0
+
+    train_loader = make_dataloader(
+        train_dataset,
+        BATCH_SIZE,
+        shuffle=True,
+        num_workers=args.workers,
+        prefetch_factor=args.prefetch_factor,
+    )
+    val_loader = make_dataloader(
+        validation_dataset,
+        BATCH_SIZE,
+        shuffle=True,
+        num_workers=args.workers,
+        prefetch_factor=args.prefetch_factor,
+    )
+
+    # if retraining
+    if args.r:
+        # the regularization set is memory-mapped and only the sampled batches are unpickled
+        reg_dataset = open_pair_store(args.reg)
+        print(f"regularization set: {len(reg_dataset)} samples")
+        # a single batch is drawn from the regularization loader per training step,
+        # the stream keeps its iterator between steps so that every step gets the next batch
+        # of one shuffled pass. Worker processes would only prefetch batches that are never used.
+        reg_loader = BatchStream(
+            DataLoader(
+                reg_dataset,
+                batch_size=1024,
+                shuffle=True,
+                follow_batch=["x_p", "x_d"],
+            )
+        )
+    else:
+        reg_loader = None
+
     # put model in training mode
     model.train()
     print(
@@ -149,6 +420,10 @@ def main():
     print(f"LR: {LEARNING_RATE}")
     print(f"Batch-size: {BATCH_SIZE}")
     print(f"Training on {DEVICE}.")
+    print(
+        f"Threads: {torch.get_num_threads()} intra-op, "
+        f"{torch.get_num_interop_threads()} inter-op, {args.workers} DataLoader workers."
+    )
     print(f"Saving models to: {args.path}")
     gcn_full_training(
         model.to(device=DEVICE),
@@ -0,0 +1,215 @@
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from model_variants import VARIANTS
+
+
+class CSVPredictionWriter:
+    def __init__(self, filename: str, columns: list):
+        self.fh = open(filename, "w", newline="")
+        self.writer = csv.writer(self.fh)
+        self.writer.writerow(columns)
+
+    def write(self, rows: list):
+        self.writer.writerows(rows)
+        # flush so that partial results are usable while the run continues
+        self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+
+class ParquetPredictionWriter:
+    def __init__(self, filename: str, columns: list):
+        # pyarrow is only needed for parquet output
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema(
+            [(c, pa.string()) for c in columns[:3]]
+            + [(c, pa.float32()) for c in columns[3:]]
+        )
+        self.writer = pq.ParquetWriter(filename, self.schema)
+
+    def write(self, rows: list):
+        # every batch is written as its own row group
+        table = self.pa.Table.from_arrays(
+            [
+                self.pa.array([row[i] for row in rows], type=field.type)
+                for i, field in enumerate(self.schema)
+            ],
+            schema=self.schema,
+        )
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+def main():
+    """
+    takes pytorch geometric graph data (pkl or pair store) and one or more trained models
+    and writes the predicted pKa values for every pair to a csv or parquet file.
+    Pairs are streamed in batches and predictions are written after every batch.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input", required=True, help="input filename, type: .pkl or pair store"
+    )
+    parser.add_argument(
+        "--output", required=True, help="output filename, type: .csv or .parquet"
+    )
+    parser.add_argument(
+        "--model",
+        nargs="+",
+        required=True,
+        help="model checkpoints or glob patterns, e.g. 'trained_models/training_run_*/fine_tuned_best_model.pt'",
+    )
+    parser.add_argument(
+        "--variant",
+        default="eager",
+        choices=VARIANTS,
+        help="model variant used for inference, int8 runs on the CPU (default=eager)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=4096, help="pairs per batch (default=4096)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="number of DataLoader workers used for unpickling and batching",
+    )
+    parser.add_argument(
+        "--cache",
+        default="",
+        help="SQLite file used as persistent prediction cache (default: no cache)",
+    )
+    parser.add_argument(
+        "--cache-memory-items",
+        type=int,
+        default=1_000_000,
+        help="entries kept in the in-memory cache tier (default=1000000)",
+    )
+    parser.add_argument(
+        "--cache-disk-items",
+        type=int,
+        default=0,
+        help="maximum entries of the cache file, 0 means unlimited (default=0)",
+    )
+    parser.add_argument(
+        "--report-every",
+        type=int,
+        default=50,
+        help="print throughput every n batches (default=50)",
+    )
+    args = parser.parse_args()
+    print("inputfile:", args.input)
+    print("outputfile:", args.output)
+
+    # torch is only imported once the arguments are parsed
+    import torch
+    from pkasolver.constants import DEVICE
+
+    from inference import (
+        expand_checkpoints,
+        file_fingerprint,
+        load_model,
+        make_prediction_loader,
+        open_pyg_data,
+        predict_batch,
+        prepare_model,
+    )
+    from prediction_cache import (
+        PredictionCache,
+        ensemble_fingerprint,
+        predict_with_cache,
+    )
+
+    checkpoints = expand_checkpoints(args.model)
+    print(f"{len(checkpoints)} models used")
+    device = torch.device("cpu") if args.variant == "int8" else DEVICE
+    models = [
+        prepare_model(load_model(checkpoint, device), args.variant)
+        for checkpoint in checkpoints
+    ]
+
+    cache = None
+    if args.cache:
+        cache = PredictionCache(
+            args.cache, args.cache_memory_items, args.cache_disk_items
+        )
+        model_fingerprint = ensemble_fingerprint(
+            [file_fingerprint(checkpoint) for checkpoint in checkpoints], args.variant
+        )
+        print(f"prediction cache: {args.cache}")
+
+    dataset = open_pyg_data(args.input)
+    print(f"{len(dataset)} pairs to predict")
+    loader = make_prediction_loader(dataset, args.batch_size, args.workers)
+
+    columns = ["chembl_id", "internal_id", "reaction_center", "predicted_pKa"]
+    if len(models) > 1:
+        columns += ["predicted_pKa_std"]
+        columns += [f"pKa_model_{i}" for i in range(len(models))]
+    if args.output.endswith(".parquet"):
+        writer = ParquetPredictionWriter(args.output, columns)
+    else:
+        writer = CSVPredictionWriter(args.output, columns)
+
+    print(
+        f"Predicting with {args.variant} models on {device} with {torch.get_num_threads()} threads."
+    )
+    nr_of_pairs = 0
+    start = time.perf_counter()
+    try:
+        for nr_of_batches, (batch, meta) in enumerate(loader, 1):
+            if cache is None:
+                predictions = predict_batch(models, batch)
+            else:
+                predictions = predict_with_cache(
+                    models, batch, meta, cache, model_fingerprint
+                )
+            mean = predictions.mean(axis=0)
+            values = [mean]
+            if len(models) > 1:
+                values += [predictions.std(axis=0)]
+                values += list(predictions)
+            values = np.stack(values, axis=1).tolist()
+            writer.write(
+                [
+                    [chembl_id, internal_id, str(reaction_center)] + row
+                    for (chembl_id, internal_id, reaction_center, _, _), row in zip(
+                        meta, values
+                    )
+                ]
+            )
+            nr_of_pairs += len(meta)
+            if nr_of_batches % args.report_every == 0:
+                elapsed = time.perf_counter() - start
+                print(
+                    f"{nr_of_pairs} pairs, {nr_of_pairs / elapsed:.1f} pairs/s, "
+                    f"{nr_of_pairs * len(models) / elapsed:.1f} predictions/s"
+                )
+                if cache is not None:
+                    print(cache.stats())
+    finally:
+        writer.close()
+        if cache is not None:
+            print(cache.stats())
+            cache.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"predicted {nr_of_pairs} pairs with {len(models)} models in {elapsed:.1f}s "
+        f"({nr_of_pairs / max(elapsed, 1e-9):.1f} pairs/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
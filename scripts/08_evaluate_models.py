@@ -0,0 +1,167 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+METRICS = ["MAE", "RMSE", "R2"]
+
+
+def calculate_metrics(y: np.ndarray, y_pred: np.ndarray) -> dict:
+    """
+    calculates MAE, RMSE and R2 along the last axis.
+    y and y_pred can have any leading (e.g. bootstrap) dimensions.
+    """
+    error = y_pred - y
+    ss_res = np.sum(error**2, axis=-1)
+    ss_tot = np.sum((y - y.mean(axis=-1, keepdims=True)) ** 2, axis=-1)
+    return {
+        "MAE": np.mean(np.abs(error), axis=-1),
+        "RMSE": np.sqrt(ss_res / y.shape[-1]),
+        "R2": 1.0 - ss_res / ss_tot,
+    }
+
+
+def bootstrap_metrics(
+    y: np.ndarray, y_pred: np.ndarray, bootstrap_idx: np.ndarray
+) -> dict:
+    """
+    returns the metrics on the full data set and their 95% bootstrap confidence intervals.
+    bootstrap_idx has the shape (nr_of_resamples, nr_of_pairs) and all resamples
+    are evaluated in one array operation.
+    """
+    point = calculate_metrics(y, y_pred)
+    resampled = calculate_metrics(y[bootstrap_idx], y_pred[bootstrap_idx])
+    results = {}
+    for metric in METRICS:
+        low, high = np.percentile(resampled[metric], [2.5, 97.5])
+        results[metric] = (float(point[metric]), float(low), float(high))
+    return results
+
+
+def predict_with_cache(
+    checkpoints: list, dataset, data_fingerprint: str, cache_dir: str, batch_size: int
+) -> np.ndarray:
+    """
+    returns the predictions of every checkpoint on dataset, shape: (nr_of_models, nr_of_pairs).
+    Predictions are cached per checkpoint and data set content, only checkpoints
+    without cached predictions are evaluated.
+    """
+    from inference import file_fingerprint, load_model, make_prediction_loader, predict_batch
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_files = [
+        os.path.join(
+            cache_dir, f"{data_fingerprint[:16]}_{file_fingerprint(checkpoint)[:16]}.npy"
+        )
+        for checkpoint in checkpoints
+    ]
+    missing = [i for i, f in enumerate(cache_files) if not os.path.isfile(f)]
+    print(f"{len(checkpoints) - len(missing)} cached, {len(missing)} models to evaluate")
+
+    if missing:
+        models = [load_model(checkpoints[i]) for i in missing]
+        loader = make_prediction_loader(dataset, batch_size)
+        predictions = np.concatenate(
+            [predict_batch(models, batch) for batch, _ in loader], axis=1
+        )
+        for i, model_predictions in zip(missing, predictions):
+            np.save(cache_files[i], model_predictions)
+
+    return np.stack([np.load(f) for f in cache_files])
+
+
+def main():
+    """
+    evaluates trained models on test sets (e.g. Novartis and AvLiLuMoVe) and
+    writes MAE, RMSE and R2 with bootstrap confidence intervals
+    for every model and for the ensemble mean to a csv file.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data",
+        nargs="+",
+        help="test sets as pytorch geometric graph data, type: .pkl or pair store",
+    )
+    parser.add_argument(
+        "--model",
+        nargs="+",
+        default=[
+            "trained_models/training_run_*/pretrained_best_model.pt",
+            "trained_models/training_run_*/fine_tuned_best_model.pt",
+        ],
+        help="model checkpoints or glob patterns (default: all pretrained and fine tuned models)",
+    )
+    parser.add_argument("--output", help="output filename, type: .csv")
+    parser.add_argument(
+        "--cache",
+        default="evaluation_cache",
+        help="directory for cached predictions (default=evaluation_cache)",
+    )
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        default=10_000,
+        help="number of bootstrap resamples (default=10000)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=42, help="seed for bootstrap resampling"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=4096, help="pairs per batch (default=4096)"
+    )
+    args = parser.parse_args()
+    print("outputfile:", args.output)
+
+    # torch is only imported once the arguments are parsed
+    from inference import expand_checkpoints, file_fingerprint, open_pyg_data
+
+    checkpoints = expand_checkpoints(args.model)
+    print(f"{len(checkpoints)} models used")
+    rng = np.random.default_rng(args.seed)
+
+    rows = []
+    for data_file in args.data:
+        data_name = os.path.splitext(os.path.basename(data_file.rstrip("/")))[0]
+        print(f"evaluating on {data_name}")
+        dataset = open_pyg_data(data_file)
+        y = np.array([float(pair.reference_value) for pair in dataset])
+        predictions = predict_with_cache(
+            checkpoints, dataset, file_fingerprint(data_file), args.cache, args.batch_size
+        )
+        # the same resamples are used for every model so that the intervals are comparable
+        bootstrap_idx = rng.integers(0, len(y), size=(args.bootstrap, len(y)))
+
+        members = [
+            (checkpoint, predictions[i]) for i, checkpoint in enumerate(checkpoints)
+        ]
+        # one ensemble per checkpoint type (e.g. pretrained_best_model.pt)
+        ensembles = {}
+        for i, checkpoint in enumerate(checkpoints):
+            ensembles.setdefault(os.path.basename(checkpoint), []).append(i)
+        for kind, idx in ensembles.items():
+            members.append((f"ensemble:{kind}", predictions[idx].mean(axis=0)))
+
+        for name, y_pred in members:
+            results = bootstrap_metrics(y, y_pred, bootstrap_idx)
+            for metric, (value, low, high) in results.items():
+                rows.append([data_name, name, metric, value, low, high])
+
+        for kind, idx in ensembles.items():
+            ensemble = bootstrap_metrics(y, predictions[idx].mean(axis=0), bootstrap_idx)
+            single = calculate_metrics(y, predictions[idx])
+            for metric in METRICS:
+                value, low, high = ensemble[metric]
+                print(
+                    f"{data_name} {kind} {metric}: ensemble {value:.3f} [{low:.3f}, {high:.3f}], "
+                    f"single models {single[metric].mean():.3f} +- {single[metric].std():.3f}"
+                )
+
+    with open(args.output, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["data_set", "model", "metric", "value", "ci_low", "ci_high"])
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
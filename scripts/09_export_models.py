@@ -0,0 +1,203 @@
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+from model_variants import VARIANTS
+
+
+def timed_predictions(model, batches: list, repeats: int) -> tuple:
+    """
+    returns the predictions of a model on pre-collated batches and
+    the best wall time of repeats passes over all batches.
+    """
+    from inference import predict_batch
+
+    # warm up (compilation, allocator)
+    predict_batch([model], batches[0])
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predictions = np.concatenate(
+            [predict_batch([model], batch)[0] for batch in batches]
+        )
+        best = min(best, time.perf_counter() - start)
+    return predictions, best
+
+
+def export_checkpoint(checkpoint: str, model, torchscript: bool):
+    """
+    writes the int8 variant of a checkpoint next to it and,
+    if requested and possible, a TorchScript version of the eager model.
+    """
+    import torch
+
+    from inference import quantize_model
+
+    base = os.path.splitext(checkpoint)[0]
+    quantized_model = quantize_model(model)
+    torch.save(
+        {"model_state_dict": quantized_model.state_dict(), "variant": "int8"},
+        f"{base}_int8.pt",
+    )
+    print(f"written: {base}_int8.pt")
+    if torchscript:
+        try:
+            scripted = torch.jit.script(model)
+        except Exception as e:
+            # the message passing layers of torch geometric are not always scriptable
+            print(f"TorchScript export of {checkpoint} failed: {e}")
+        else:
+            scripted.save(f"{base}_scripted.pt")
+            print(f"written: {base}_scripted.pt")
+
+
+def main():
+    """
+    exports trained models as int8 (dynamically quantized) variants and
+    writes an accuracy versus speed report of the eager, int8 and compiled
+    variants on the test sets (e.g. the Baltruschat sets) to a csv file.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model",
+        nargs="+",
+        default=["trained_models/training_run_*/fine_tuned_best_model.pt"],
+        help="model checkpoints or glob patterns (default: all fine tuned models)",
+    )
+    parser.add_argument(
+        "--data",
+        nargs="+",
+        help="test sets as pytorch geometric graph data, type: .pkl or pair store",
+    )
+    parser.add_argument("--output", help="report filename, type: .csv")
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        default=VARIANTS,
+        choices=VARIANTS,
+        help="variants compared in the report, eager is always included (default: all)",
+    )
+    parser.add_argument(
+        "--export", action="store_true", help="write int8 checkpoints next to the models"
+    )
+    parser.add_argument(
+        "--torchscript",
+        action="store_true",
+        help="additionally try to export TorchScript versions of the models",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=4096, help="pairs per batch (default=4096)"
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="timed passes per variant (default=3)"
+    )
+    args = parser.parse_args()
+    print("outputfile:", args.output)
+
+    # torch is only imported once the arguments are parsed
+    import torch
+
+    from inference import (
+        expand_checkpoints,
+        load_model,
+        make_prediction_loader,
+        open_pyg_data,
+        prepare_model,
+    )
+
+    # quantized Linear layers are only implemented for the CPU
+    device = torch.device("cpu")
+    checkpoints = expand_checkpoints(args.model)
+    print(f"{len(checkpoints)} models used")
+    # the drift of every variant is measured against the eager model
+    variants = ["eager"] + [v for v in args.variants if v != "eager"]
+
+    data_sets = []
+    for data_file in args.data:
+        data_name = os.path.splitext(os.path.basename(data_file.rstrip("/")))[0]
+        dataset = open_pyg_data(data_file)
+        y = np.array([float(pair.reference_value) for pair in dataset])
+        batches = [
+            batch for batch, _ in make_prediction_loader(dataset, args.batch_size)
+        ]
+        data_sets.append((data_name, y, batches))
+
+    rows = []
+    for checkpoint in checkpoints:
+        model = load_model(checkpoint, device=device)
+        if args.export:
+            export_checkpoint(checkpoint, model, args.torchscript)
+        for data_name, y, batches in data_sets:
+            for variant in variants:
+                try:
+                    variant_model = prepare_model(
+                        load_model(checkpoint, device), variant
+                    )
+                    predictions, seconds = timed_predictions(
+                        variant_model, batches, args.repeats
+                    )
+                except Exception as e:
+                    if variant == "eager":
+                        raise
+                    # torch.compile needs a working inductor backend and C++ compiler
+                    print(f"{variant} variant of {checkpoint} unavailable: {e}")
+                    rows.append(
+                        [checkpoint, data_name, variant] + [float("nan")] * 4
+                    )
+                    continue
+                if variant == "eager":
+                    eager_predictions = predictions
+                drift = np.abs(predictions - eager_predictions)
+                rows.append(
+                    [
+                        checkpoint,
+                        data_name,
+                        variant,
+                        float(np.mean(np.abs(predictions - y))),
+                        float(np.mean(drift)),
+                        float(np.max(drift)),
+                        len(y) / seconds,
+                    ]
+                )
+
+    columns = [
+        "model",
+        "data_set",
+        "variant",
+        "MAE",
+        "mean_abs_drift",
+        "max_abs_drift",
+        "pairs_per_s",
+    ]
+    with open(args.output, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+    # summary over all models
+    for data_name, _, _ in data_sets:
+        for variant in variants:
+            selected = [
+                row
+                for row in rows
+                if row[1] == data_name and row[2] == variant and not np.isnan(row[3])
+            ]
+            if not selected:
+                print(f"{data_name} {variant}: unavailable")
+                continue
+            mae = np.mean([row[3] for row in selected])
+            drift = np.mean([row[4] for row in selected])
+            speed = np.mean([row[6] for row in selected])
+            if variant == "eager":
+                eager_speed = speed
+            print(
+                f"{data_name} {variant}: MAE {mae:.3f}, mean drift {drift:.4f}, "
+                f"{speed:.1f} pairs/s ({speed / eager_speed:.2f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import csv
+import importlib
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# subcommand: (module, description)
+# the modules are only imported when their subcommand is run, and the modules themselves
+# only import RDKit, torch, etc. once their arguments are parsed
+COMMANDS = {
+    "download": (
+        "00_download_mols_from_chembl",
+        "download molecules from the ChEMBL database",
+    ),
+    "sdf-to-mae": ("01_convert_sdf_to_mae", "convert sdf to Schrödinger mae files"),
+    "epik": ("02_predict_pka_with_epik", "predict microstate pKa values with Epik"),
+    "mae-to-sdf": ("03_convert_mae_to_sdf", "convert Schrödinger mae to sdf files"),
+    "filter": ("04_0_filter_testmols", "remove test set molecules from a training set"),
+    "split-epik": (
+        "04_1_split_epik_output",
+        "split Epik output in protonated/deprotonated pairs",
+    ),
+    "prepare": (
+        "04_2_prepare_rest",
+        "split experimental data sets in protonated/deprotonated pairs",
+    ),
+    "preprocess": ("05_data_preprocess", "generate pytorch geometric graph data"),
+    "train": ("06_training", "train or fine tune a model"),
+    "predict": ("07_predict_pka", "predict pKa values with trained models"),
+    "evaluate": ("08_evaluate_models", "evaluate trained models on test sets"),
+    "export": ("09_export_models", "export int8 models and benchmark model variants"),
+    "split": ("dataset_split", "write training/validation split indices"),
+    "pair-store": ("pair_store", "convert pyg pkl files to pair stores"),
+    "sdf-index": ("sdf_index", "index sdf files and print single records"),
+}
+
+
+def run_command(command: str, argv: list):
+    """
+    imports the module of a subcommand and runs its main function with argv.
+    """
+    module_name, _ = COMMANDS[command]
+    # the scripts import their helper modules from the scripts directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    module = importlib.import_module(module_name)
+    sys.argv = [f"{os.path.basename(sys.argv[0])} {command}"] + argv
+    module.main()
+
+
+def time_command(argv: list, repeats: int) -> list:
+    """
+    returns the wall times of repeats runs of a command in a new interpreter.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + argv,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings: list) -> tuple:
+    return statistics.median(timings), min(timings)
+
+
+def benchmark_startup(argv: list):
+    """
+    measures the startup time (python cli.py <command> --help) of every subcommand
+    in a new interpreter, the interpreter startup itself is reported as "python".
+    """
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} benchmark-startup"
+    )
+    parser.add_argument(
+        "--commands",
+        nargs="+",
+        default=list(COMMANDS),
+        choices=list(COMMANDS),
+        help="subcommands to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--repeats", type=int, default=5, help="runs per subcommand (default=5)"
+    )
+    parser.add_argument(
+        "--output", default="", help="write the timings to a csv file"
+    )
+    args = parser.parse_args(argv)
+
+    rows = [["python", *summarize(time_command(["-c", "pass"], args.repeats))]]
+    for command in args.commands:
+        timings = time_command([os.path.abspath(__file__), command, "--help"], args.repeats)
+        rows.append([command, *summarize(timings)])
+
+    print(f"{'command':<12} {'median [s]':>10} {'min [s]':>10}")
+    for command, median, best in rows:
+        print(f"{command:<12} {median:>10.3f} {best:>10.3f}")
+    if args.output:
+        with open(args.output, "w", newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["command", "median", "min"])
+            writer.writerows(rows)
+
+
+def main():
+    """
+    single entry point for the data preparation, training and inference scripts:
+    python cli.py <command> [options], python cli.py <command> --help lists the options.
+    """
+    parser = argparse.ArgumentParser(
+        description="pkasolver data and training pipeline",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n"
+        + "\n".join(
+            f"  {command:<18} {description}"
+            for command, (_, description) in COMMANDS.items()
+        )
+        + f"\n  {'benchmark-startup':<18} measure the startup time of every command",
+    )
+    parser.add_argument(
+        "command", choices=list(COMMANDS) + ["benchmark-startup"], metavar="command"
+    )
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="options of the command")
+    args = parser.parse_args()
+    if args.command == "benchmark-startup":
+        benchmark_startup(args.args)
+    else:
+        run_command(args.command, args.args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import argparse
+import pickle
+
+import numpy as np
+
+from fingerprints import (
+    FingerprintIndex,
+    bit_counts,
+    morgan_fingerprints,
+    tanimoto_matrix,
+    unpack_bits,
+)
+
+SPLIT_METHODS = ["random", "chembl_id", "scaffold", "cluster"]
+
+
+def scaffold_smiles(smiles: str) -> str:
+    """
+    returns the Bemis-Murcko scaffold of a molecule as canonical SMILES
+    ("" for acyclic or unparsable molecules).
+    """
+    from rdkit import Chem
+    from rdkit.Chem.Scaffolds import MurckoScaffold
+
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return ""
+    return MurckoScaffold.MurckoScaffoldSmiles(mol=mol)
+
+
+def leader_clustering(
+    fps: np.ndarray, threshold: float, order: np.ndarray, chunk_size: int = 1024
+) -> np.ndarray:
+    """
+    leader clustering of packed fingerprints: molecules are visited in the given order,
+    each molecule joins the most similar existing leader with a Tanimoto similarity >= threshold
+    or becomes a new leader. Returns the cluster label of every molecule.
+    """
+    labels = np.full(len(fps), -1, dtype=np.int64)
+    # the leaders are kept in one index that grows, cluster labels are their ids
+    leaders = FingerprintIndex()
+    nr_of_leaders = 0
+    for start in range(0, len(order), chunk_size):
+        idx = order[start : start + chunk_size]
+        # compare the whole chunk with all leaders found so far
+        best_sim, best_label = leaders.max_similarity(fps[idx], threshold)
+        # and with the leaders found in the chunk itself, in the order they are visited
+        bits = unpack_bits(fps[idx])
+        counts = bit_counts(fps[idx])
+        sim = tanimoto_matrix(bits, counts, bits, counts)
+        new_leaders = []
+        for i in range(len(idx)):
+            if best_sim[i] >= threshold:
+                labels[idx[i]] = best_label[i]
+                continue
+            labels[idx[i]] = nr_of_leaders
+            new_leaders.append(i)
+            # molecules visited later join the new leader if it is more similar
+            better = sim[i, i + 1 :] > best_sim[i + 1 :]
+            best_sim[i + 1 :][better] = sim[i, i + 1 :][better]
+            best_label[i + 1 :][better] = nr_of_leaders
+            nr_of_leaders += 1
+        if new_leaders:
+            leaders.add(fps[idx[new_leaders]], labels[idx[new_leaders]])
+    return labels
+
+
+def group_labels(
+    dataset, method: str, seed: int, threshold: float = 0.6, nbits: int = 1024
+) -> np.ndarray:
+    """
+    returns a group label for every PairData object. All pairs of a chembl_id are in the same group,
+    for scaffold and cluster the first pair of each chembl_id defines the group of the molecule.
+    """
+    chembl_ids = [pair.chembl_id for pair in dataset]
+    unique_ids, labels = np.unique(chembl_ids, return_inverse=True)
+    if method == "chembl_id":
+        return labels
+
+    # one representative molecule per chembl_id
+    first = np.full(len(unique_ids), -1, dtype=np.int64)
+    for i in range(len(labels) - 1, -1, -1):
+        first[labels[i]] = i
+    smiles = [dataset[i].smiles_prop for i in first]
+
+    if method == "scaffold":
+        scaffolds = [scaffold_smiles(s) for s in smiles]
+        # acyclic molecules have no scaffold and are kept as their own group
+        scaffolds = [s if s else f"chembl_id:{c}" for s, c in zip(scaffolds, unique_ids)]
+        _, scaffold_labels = np.unique(scaffolds, return_inverse=True)
+        return scaffold_labels[labels]
+    elif method == "cluster":
+        from rdkit import Chem
+
+        # parsed on the fly, only the packed fingerprints are kept
+        fps = morgan_fingerprints(
+            (Chem.MolFromSmiles(s) or Chem.Mol() for s in smiles), nbits=nbits
+        )
+        order = np.random.default_rng(seed).permutation(len(fps))
+        cluster_labels = leader_clustering(fps, threshold, order)
+        print(f"{cluster_labels.max() + 1} clusters for {len(fps)} molecules")
+        return cluster_labels[labels]
+    else:
+        raise RuntimeError(f"unknown split method {method}, use one of {SPLIT_METHODS}")
+
+
+def group_split(groups: np.ndarray, test_size: float, seed: int) -> tuple:
+    """
+    randomly assigns whole groups to the validation set until it holds test_size of all samples.
+    Groups that would overshoot the target are skipped.
+    """
+    unique_groups, group_sizes = np.unique(groups, return_counts=True)
+    target = int(round(test_size * len(groups)))
+    is_val_group = np.zeros(len(unique_groups), dtype=bool)
+    nr_of_val = 0
+    for g in np.random.default_rng(seed).permutation(len(unique_groups)):
+        if nr_of_val >= target:
+            break
+        if nr_of_val + group_sizes[g] <= target:
+            is_val_group[g] = True
+            nr_of_val += group_sizes[g]
+    is_val = is_val_group[np.searchsorted(unique_groups, groups)]
+    return np.flatnonzero(~is_val), np.flatnonzero(is_val)
+
+
+def split_indices(
+    dataset, method: str, seed: int, test_size: float = 0.1, threshold: float = 0.6
+) -> tuple:
+    """
+    returns the training and validation indices of dataset for a split method.
+    """
+    if method == "random":
+        from sklearn.model_selection import train_test_split
+
+        # same split as train_test_split on the dataset itself
+        train_idx, val_idx = train_test_split(
+            np.arange(len(dataset)), test_size=test_size, shuffle=True, random_state=seed
+        )
+        return train_idx, val_idx
+    groups = group_labels(dataset, method, seed, threshold)
+    return group_split(groups, test_size, seed)
+
+
+def save_split(filename: str, train_idx: np.ndarray, val_idx: np.ndarray, method: str):
+    np.savez(filename, train_idx=train_idx, val_idx=val_idx, method=method)
+
+
+def load_split(filename: str) -> tuple:
+    split = np.load(filename)
+    return split["train_idx"], split["val_idx"]
+
+
+def main():
+    """
+    takes pytorch geometric graph data and writes training/validation indices
+    for a random, chembl_id, scaffold or fingerprint cluster split to a .npz file
+    that can be passed to 06_training.py with --split-file.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", help="input filename, type: .pkl")
+    parser.add_argument("--output", help="output filename, type: .npz")
+    parser.add_argument(
+        "--method", default="scaffold", choices=SPLIT_METHODS, help="split method"
+    )
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument(
+        "--test-size",
+        type=float,
+        default=0.1,
+        help="fraction of the validation set (default=0.1)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.6,
+        help="Tanimoto similarity threshold of the cluster split (default=0.6)",
+    )
+    args = parser.parse_args()
+    print("inputfile:", args.input)
+    print("outputfile:", args.output)
+    with open(args.input, "rb") as fh:
+        dataset = pickle.load(fh)
+    train_idx, val_idx = split_indices(
+        dataset, args.method, args.seed, args.test_size, args.threshold
+    )
+    print(f"{args.method} split: {len(train_idx)} training, {len(val_idx)} validation pairs")
+    save_split(args.output, train_idx, val_idx, args.method)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import numpy as np
+
+# the batched featurizer produces the same PairData objects as pkasolver.data.mol_to_paired_mol_data
+# for many pairs at once. Raw atom and bond attributes of all molecules are collected into
+# integer arrays and every feature that only depends on one attribute is looked up
+# in a table with one row per distinct value. The rows are computed once with the
+# pkasolver feature functions, so the encoding is the same as in pkasolver.
+# reaction_center only depends on whether an atom is the reaction center,
+# all other features (e.g. smarts, rotatable) are computed with the pkasolver
+# feature functions once per distinct molecule.
+ATOM_ATTRIBUTES = {
+    "element": lambda atom: atom.GetAtomicNum(),
+    "formal_charge": lambda atom: atom.GetFormalCharge(),
+    "hybridization": lambda atom: int(atom.GetHybridization()),
+    "total_num_Hs": lambda atom: atom.GetTotalNumHs(),
+    "explicit_num_Hs": lambda atom: atom.GetNumExplicitHs(),
+    "aromatic_tag": lambda atom: int(atom.GetIsAromatic()),
+    "total_valence": lambda atom: atom.GetTotalValence(),
+    "total_degree": lambda atom: atom.GetTotalDegree(),
+    "is_in_ring": lambda atom: int(atom.IsInRing()),
+}
+BOND_ATTRIBUTES = {
+    "bond_type": lambda bond: int(bond.GetBondType()),
+    "is_conjugated": lambda bond: int(bond.GetIsConjugated()),
+}
+REACTION_CENTER = "reaction_center"
+
+FEATURIZERS = ["batched", "reference"]
+
+
+def lookup(table: dict, feature, values: np.ndarray, arguments) -> np.ndarray:
+    """
+    returns the feature rows of all values. Rows of values that are not in the table yet
+    are computed with the feature function, arguments(idx) returns its arguments
+    for the atom/bond idx (the first one with that value).
+    """
+    unique, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    for value, idx in zip(unique.tolist(), first):
+        if value not in table:
+            table[value] = np.asarray(
+                feature(*arguments(idx)), dtype=np.float32
+            ).reshape(-1)
+    return np.stack([table[value] for value in unique.tolist()])[inverse.reshape(-1)]
+
+
+class BatchFeaturizer:
+    """
+    featurizes lists of (protonated mol, deprotonated mol, reaction center) pairs with the
+    pkasolver node and edge feature dicts (see pkasolver.data.make_features_dicts).
+    Lookup tables are kept between batches.
+    """
+
+    def __init__(self, selected_node_features: dict, selected_edge_features: dict):
+        self.node_features = selected_node_features
+        self.edge_features = selected_edge_features
+        self.atom_keys = [n for n in selected_node_features if n in ATOM_ATTRIBUTES]
+        self.bond_keys = [n for n in selected_edge_features if n in BOND_ATTRIBUTES]
+        self.tables = {
+            name: {} for name in self.atom_keys + self.bond_keys + [REACTION_CENTER]
+        }
+
+    def _node_features(self, mols: list, reaction_centers: list) -> list:
+        """
+        returns the node feature matrix of every mol and the columns of the reaction center feature,
+        which are left empty (they differ between pairs of the same molecule).
+        """
+        nr_of_atoms = [mol.GetNumAtoms() for mol in mols]
+        atom_offsets = np.concatenate([[0], np.cumsum(nr_of_atoms)])
+        atoms = [atom for mol in mols for atom in mol.GetAtoms()]
+        getters = [ATOM_ATTRIBUTES[name] for name in self.atom_keys]
+        attributes = np.array(
+            [[getter(atom) for getter in getters] for atom in atoms], dtype=np.int64
+        ).reshape(len(atoms), len(getters))
+        # mol of every atom
+        atom_mol = np.repeat(np.arange(len(mols)), nr_of_atoms)
+
+        def arguments(idx):
+            return atoms[idx], reaction_centers[atom_mol[idx]]
+
+        columns = []
+        center_columns = None
+        width = 0
+        for name, feature in self.node_features.items():
+            if name in ATOM_ATTRIBUTES:
+                rows = lookup(
+                    self.tables[name],
+                    feature,
+                    attributes[:, self.atom_keys.index(name)],
+                    arguments,
+                )
+            elif name == REACTION_CENTER:
+                center_width = len(self._center_row(mols[0], reaction_centers[0], True))
+                rows = np.zeros((len(atoms), center_width), dtype=np.float32)
+                center_columns = slice(width, width + center_width)
+            else:
+                rows = np.array(
+                    [feature(*arguments(idx)) for idx in range(len(atoms))],
+                    dtype=np.float32,
+                ).reshape(len(atoms), -1)
+            columns.append(rows)
+            width += rows.shape[1]
+        x = np.concatenate(columns, axis=1)
+        return [
+            x[atom_offsets[m] : atom_offsets[m + 1]] for m in range(len(mols))
+        ], center_columns
+
+    def _center_row(self, mol, reaction_center, is_center: bool) -> np.ndarray:
+        """
+        returns the reaction center feature of an atom that is (not) the reaction center.
+        """
+        table = self.tables[REACTION_CENTER]
+        if is_center not in table:
+            center = int(reaction_center)
+            if is_center:
+                atom = mol.GetAtomWithIdx(center)
+            else:
+                atom = mol.GetAtomWithIdx(1 if center == 0 else 0)
+            table[is_center] = np.asarray(
+                self.node_features[REACTION_CENTER](atom, reaction_center),
+                dtype=np.float32,
+            ).reshape(-1)
+        return table[is_center]
+
+    def _edge_features(self, mols: list) -> list:
+        """
+        returns edge_index and edge_attr of every mol. Every bond is added in both directions.
+        """
+        nr_of_bonds = [mol.GetNumBonds() for mol in mols]
+        bond_offsets = np.concatenate([[0], np.cumsum(nr_of_bonds)])
+        bonds = [bond for mol in mols for bond in mol.GetBonds()]
+        ends = np.array(
+            [(bond.GetBeginAtomIdx(), bond.GetEndAtomIdx()) for bond in bonds],
+            dtype=np.int64,
+        ).reshape(len(bonds), 2)
+        getters = [BOND_ATTRIBUTES[name] for name in self.bond_keys]
+        attributes = np.array(
+            [[getter(bond) for getter in getters] for bond in bonds], dtype=np.int64
+        ).reshape(len(bonds), len(getters))
+
+        def arguments(idx):
+            return (bonds[idx],)
+
+        columns = []
+        for name, feature in self.edge_features.items():
+            if name in BOND_ATTRIBUTES:
+                rows = lookup(
+                    self.tables[name],
+                    feature,
+                    attributes[:, self.bond_keys.index(name)],
+                    arguments,
+                )
+            else:
+                rows = np.array(
+                    [feature(bond) for bond in bonds], dtype=np.float32
+                ).reshape(len(bonds), -1)
+            columns.append(rows)
+        attr = np.concatenate(columns, axis=1)
+
+        results = []
+        for m in range(len(mols)):
+            mol_ends = ends[bond_offsets[m] : bond_offsets[m + 1]]
+            # (begin, end), (end, begin) for every bond, as in pkasolver.data.make_edges_and_attr
+            edge_index = np.empty((2, 2 * len(mol_ends)), dtype=np.int64)
+            edge_index[:, 0::2] = mol_ends.T
+            edge_index[:, 1::2] = mol_ends[:, ::-1].T
+            edge_attr = np.repeat(attr[bond_offsets[m] : bond_offsets[m + 1]], 2, axis=0)
+            results.append((edge_index, edge_attr))
+        return results
+
+    def _charges(self, mols: list) -> list:
+        """
+        returns the total charge (sum of the formal charges, numpy int64 as in pkasolver) of every mol.
+        """
+        return [
+            np.sum([atom.GetFormalCharge() for atom in mol.GetAtoms()]) for mol in mols
+        ]
+
+    def featurize(self, pairs: list) -> list:
+        """
+        takes a list of (mol_prot, mol_deprot, reaction_center) tuples and returns their PairData objects.
+        Molecules that occur in several pairs are featurized once.
+        Pairs with a molecule without bonds are featurized with mol_to_paired_mol_data.
+        """
+        import torch
+        from pkasolver.data import PairData, mol_to_paired_mol_data
+        from rdkit import Chem
+
+        batched, fallback = [], []
+        for i, (mol_prot, mol_deprot, _) in enumerate(pairs):
+            if mol_prot.GetNumBonds() and mol_deprot.GetNumBonds():
+                batched.append(i)
+            else:
+                fallback.append(i)
+
+        # distinct molecules, a molecule is often the deprotonated form of one pair
+        # and the protonated form of the next one
+        mol_keys = {}
+        mols, mol_centers = [], []
+        pair_mols = {}
+        for i in batched:
+            mol_prot, mol_deprot, reaction_center = pairs[i]
+            keys = []
+            for mol in (mol_prot, mol_deprot):
+                key = mol.ToBinary(Chem.PropertyPickleOptions.NoProps)
+                if key not in mol_keys:
+                    mol_keys[key] = len(mols)
+                    mols.append(mol)
+                    mol_centers.append(reaction_center)
+                keys.append(mol_keys[key])
+            pair_mols[i] = keys
+
+        data = [None] * len(pairs)
+        if mols:
+            node_features, center_columns = self._node_features(mols, mol_centers)
+            edge_features = self._edge_features(mols)
+            charges = self._charges(mols)
+            for i in batched:
+                reaction_center = pairs[i][2]
+                graphs = []
+                for m in pair_mols[i]:
+                    # copy, a view would keep (and pickle) the features of the whole batch
+                    x = node_features[m].copy()
+                    if center_columns is not None:
+                        is_center = np.arange(len(x)) == int(reaction_center)
+                        x[is_center, center_columns] = self._center_row(
+                            mols[m], reaction_center, True
+                        )
+                        if not is_center.all():
+                            x[~is_center, center_columns] = self._center_row(
+                                mols[m], reaction_center, False
+                            )
+                    edge_index, edge_attr = edge_features[m]
+                    graphs.append(
+                        (
+                            torch.from_numpy(x),
+                            torch.from_numpy(edge_index),
+                            torch.from_numpy(edge_attr),
+                            charges[m],
+                        )
+                    )
+                (x_p, edge_index_p, edge_attr_p, charge_p), (
+                    x_d,
+                    edge_index_d,
+                    edge_attr_d,
+                    charge_d,
+                ) = graphs
+                # same arguments as in pkasolver.data.mol_to_paired_mol_data
+                pair = PairData(
+                    edge_index_p=edge_index_p,
+                    edge_attr_p=edge_attr_p,
+                    x_p=x_p,
+                    charge_p=charge_p,
+                    edge_index_d=edge_index_d,
+                    edge_attr_d=edge_attr_d,
+                    x_d=x_d,
+                    charge_d=charge_d,
+                )
+                pair.num_nodes = len(x_p)
+                data[i] = pair
+
+        for i in fallback:
+            mol_prot, mol_deprot, reaction_center = pairs[i]
+            data[i] = mol_to_paired_mol_data(
+                mol_prot,
+                mol_deprot,
+                reaction_center,
+                self.node_features,
+                self.edge_features,
+            )
+        return data
+
+
+def compare_pair_data(pair, reference) -> list:
+    """
+    returns the attributes in which two PairData objects differ (values, types, dtypes or shapes).
+    """
+    import torch
+
+    pair_dict = pair.to_dict()
+    reference_dict = reference.to_dict()
+    differences = sorted(set(pair_dict) ^ set(reference_dict))
+    for key in sorted(set(pair_dict) & set(reference_dict)):
+        value, reference_value = pair_dict[key], reference_dict[key]
+        if isinstance(value, torch.Tensor):
+            if (
+                not isinstance(reference_value, torch.Tensor)
+                or value.dtype != reference_value.dtype
+                or value.shape != reference_value.shape
+                or not torch.equal(value, reference_value)
+            ):
+                differences.append(key)
+        elif type(value) is not type(reference_value) or value != reference_value:
+            differences.append(key)
+    return differences
+
+
+def verify_featurizer(featurizer: BatchFeaturizer, pairs: list) -> list:
+    """
+    featurizes pairs with the batched featurizer and with mol_to_paired_mol_data and
+    returns (pair number, differing attributes) for every pair that is not bit-identical.
+    """
+    from pkasolver.data import mol_to_paired_mol_data
+
+    mismatches = []
+    for i, pair in enumerate(featurizer.featurize(pairs)):
+        mol_prot, mol_deprot, reaction_center = pairs[i]
+        reference = mol_to_paired_mol_data(
+            mol_prot,
+            mol_deprot,
+            reaction_center,
+            featurizer.node_features,
+            featurizer.edge_features,
+        )
+        differences = compare_pair_data(pair, reference)
+        if differences:
+            mismatches.append((i, differences))
+    return mismatches
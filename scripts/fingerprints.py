@@ -0,0 +1,212 @@
+import numpy as np
+
+# Morgan fingerprints are stored as packed bits, one row of uint64 words per molecule
+DEFAULT_RADIUS = 2
+DEFAULT_NBITS = 2048
+
+
+def morgan_fingerprints(
+    mols,
+    radius: int = DEFAULT_RADIUS,
+    nbits: int = DEFAULT_NBITS,
+    chunk_size: int = 4096,
+) -> np.ndarray:
+    """
+    calculates Morgan fingerprints for an iterable of molecules (e.g. a generator that
+    parses them on the fly) and returns them as packed bit array of shape
+    (nr_of_mols, nbits // 64), dtype uint64.
+    Only chunk_size molecules are unpacked at a time, the molecules are not kept.
+    """
+    from rdkit.Chem import rdFingerprintGenerator
+
+    if nbits % 64:
+        raise RuntimeError(f"number of bits has to be a multiple of 64, got {nbits}")
+    generator = rdFingerprintGenerator.GetMorganGenerator(radius=radius, fpSize=nbits)
+    packed = []
+    bits = np.zeros((chunk_size, nbits), dtype=np.uint8)
+    used = 0
+    for mol in mols:
+        bits[used] = generator.GetFingerprintAsNumPy(mol)
+        used += 1
+        if used == chunk_size:
+            # big endian bit order within each byte, the order does not matter for Tanimoto similarities
+            packed.append(np.packbits(bits, axis=1))
+            used = 0
+    packed.append(np.packbits(bits[:used], axis=1))
+    return np.concatenate(packed).view(np.uint64)
+
+
+if hasattr(np, "bitwise_count"):
+
+    def popcount(x: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(x).astype(np.int32)
+
+else:
+
+    def popcount(x: np.ndarray) -> np.ndarray:
+        # SWAR popcount for numpy versions without np.bitwise_count
+        x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        x = (x & np.uint64(0x3333333333333333)) + (
+            (x >> np.uint64(2)) & np.uint64(0x3333333333333333)
+        )
+        x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return ((x * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int32)
+
+
+def bit_counts(fps: np.ndarray) -> np.ndarray:
+    """
+    returns the number of set bits of each fingerprint.
+    """
+    return popcount(fps).sum(axis=1)
+
+
+def unpack_bits(fps: np.ndarray) -> np.ndarray:
+    """
+    returns packed fingerprints as one uint8 (0/1) column per bit, shape (nr_of_mols, nbits).
+    """
+    return np.unpackbits(fps.view(np.uint8), axis=1)
+
+
+def tanimoto_matrix(
+    query_bits: np.ndarray,
+    query_counts: np.ndarray,
+    ref_bits: np.ndarray,
+    ref_counts: np.ndarray,
+) -> np.ndarray:
+    """
+    returns the Tanimoto similarities between all query and reference fingerprints
+    (unpacked, see unpack_bits), shape: (nr_of_queries, nr_of_references).
+    The number of common bits is a matrix product of the 0/1 bits (BLAS sgemm),
+    float32 is exact for up to 2**24 bits.
+    """
+    common = query_bits.astype(np.float32, copy=False) @ ref_bits.astype(
+        np.float32, copy=False
+    ).T
+    union = query_counts[:, None] + ref_counts[None, :] - common
+    return np.where(union > 0, common / np.maximum(union, 1), 0.0)
+
+
+class FingerprintIndex:
+    """
+    reference fingerprints grouped by their number of set bits.
+    Two fingerprints with a and b set bits can only reach a Tanimoto similarity
+    of t if t * a <= b <= a / t, so a query is only compared with the groups
+    in that window. Fingerprints can be added later on (e.g. new cluster leaders),
+    the groups grow without rebuilding the index.
+    """
+
+    def __init__(self, fps: np.ndarray = None, ids: np.ndarray = None):
+        # bit count: [unpacked bits, ids, number of used rows], rows are allocated in advance
+        self.groups = {}
+        self.nr_of_fps = 0
+        if fps is not None and len(fps):
+            self.add(fps, ids)
+
+    def __len__(self) -> int:
+        return self.nr_of_fps
+
+    def add(self, fps: np.ndarray, ids: np.ndarray = None):
+        """
+        adds packed fingerprints, max_similarity returns their ids (default: the order of addition).
+        """
+        if ids is None:
+            ids = np.arange(self.nr_of_fps, self.nr_of_fps + len(fps))
+        bits = unpack_bits(fps)
+        counts = bit_counts(fps)
+        for count in np.unique(counts).tolist():
+            rows = np.flatnonzero(counts == count)
+            group_bits, group_ids, used = self.groups.get(
+                count,
+                [np.empty((0, bits.shape[1]), dtype=np.uint8), np.empty(0, dtype=np.int64), 0],
+            )
+            if used + len(rows) > len(group_bits):
+                # capacity is doubled, adding n fingerprints a few at a time costs O(n) copies
+                capacity = max(2 * len(group_bits), used + len(rows), 64)
+                group_bits = np.resize(group_bits, (capacity, bits.shape[1]))
+                group_ids = np.resize(group_ids, capacity)
+            group_bits[used : used + len(rows)] = bits[rows]
+            group_ids[used : used + len(rows)] = ids[rows]
+            self.groups[count] = [group_bits, group_ids, used + len(rows)]
+        self.nr_of_fps += len(fps)
+
+    def _blocks(self, window: np.ndarray, block_size: int):
+        """
+        yields lists of (bit count, bits, ids) of the groups in window with at most
+        block_size fingerprints in total, large groups are split.
+        """
+        block, size = [], 0
+        for count in window.tolist():
+            group_bits, group_ids, used = self.groups[count]
+            for start in range(0, used, block_size):
+                stop = min(start + block_size, used)
+                if size + stop - start > block_size:
+                    yield block
+                    block, size = [], 0
+                block.append((count, group_bits[start:stop], group_ids[start:stop]))
+                size += stop - start
+        if block:
+            yield block
+
+    def max_similarity(
+        self,
+        query_fps: np.ndarray,
+        threshold: float,
+        chunk_size: int = 1024,
+        block_size: int = 8192,
+    ) -> tuple:
+        """
+        returns the highest Tanimoto similarity of every query to the references
+        and the id of the most similar reference (for ties the first one added if ids grow with it).
+        Similarities below threshold may be reported as 0 (with index -1) since they are not calculated.
+        """
+        max_sim = np.zeros(len(query_fps))
+        max_idx = np.full(len(query_fps), -1, dtype=np.int64)
+        if len(self) == 0 or len(query_fps) == 0:
+            return max_sim, max_idx
+        query_counts = bit_counts(query_fps)
+        group_counts = np.array(sorted(self.groups))
+        # queries with similar bit counts share a reference window
+        query_order = np.argsort(query_counts, kind="stable")
+        for start in range(0, len(query_order), chunk_size):
+            idx = query_order[start : start + chunk_size]
+            counts = query_counts[idx]
+            if threshold > 0.0:
+                # rounded outwards: threshold * a and a / threshold are not exact in floating point,
+                # a window that is one count too wide only costs a few extra comparisons
+                low = np.floor(threshold * counts.min())
+                high = np.ceil(counts.max() / threshold)
+                window = group_counts[(group_counts >= low) & (group_counts <= high)]
+            else:
+                window = group_counts
+            if not len(window):
+                continue
+            query_bits = unpack_bits(query_fps[idx]).astype(np.float32)
+            rows = np.arange(len(idx))
+            chunk_sim = np.zeros(len(idx))
+            chunk_idx = np.full(len(idx), -1, dtype=np.int64)
+            for block in self._blocks(window, block_size):
+                # number of common bits as matrix product of the 0/1 bits (BLAS sgemm,
+                # float32 is exact for up to 2**24 bits), small groups are multiplied together
+                common = query_bits @ np.concatenate(
+                    [bits for _, bits, _ in block]
+                ).astype(np.float32).T
+                offset = 0
+                for count, bits, ids in block:
+                    # all references of a group have the same number of set bits, so the
+                    # similarity only grows with the number of common bits
+                    best = common[:, offset : offset + len(bits)].argmax(axis=1)
+                    best_common = common[rows, offset + best].astype(np.int64)
+                    offset += len(bits)
+                    union = counts + count - best_common
+                    best_sim = np.where(union > 0, best_common / np.maximum(union, 1), 0.0)
+                    best_idx = ids[best]
+                    better = (
+                        (best_sim > chunk_sim)
+                        | ((best_sim == chunk_sim) & (best_idx < chunk_idx))
+                        | (chunk_idx < 0)
+                    )
+                    chunk_sim[better] = best_sim[better]
+                    chunk_idx[better] = best_idx[better]
+            max_sim[idx] = chunk_sim
+            max_idx[idx] = chunk_idx
+        return max_sim, max_idx
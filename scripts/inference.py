@@ -0,0 +1,184 @@
+import glob
+import hashlib
+import os
+
+import numpy as np
+import torch
+from pkasolver.constants import DEVICE
+from pkasolver.data import calculate_nr_of_features
+from pkasolver.ml_architecture import GINPairV1
+from torch_geometric.data import Batch
+
+from model_variants import VARIANTS
+from pair_store import open_pair_store
+
+# same feature selection as in 05_data_preprocess.py and 06_training.py
+node_feat_list = [
+    "element",
+    "formal_charge",
+    "hybridization",
+    "total_num_Hs",
+    "aromatic_tag",
+    "total_valence",
+    "total_degree",
+    "is_in_ring",
+    "reaction_center",
+    "smarts",
+]
+edge_feat_list = ["bond_type", "is_conjugated", "rotatable"]
+
+num_node_features = calculate_nr_of_features(node_feat_list)
+num_edge_features = calculate_nr_of_features(edge_feat_list)
+hidden_channels = 96
+
+
+def expand_checkpoints(patterns: list) -> list:
+    """
+    expands checkpoint files and glob patterns
+    (e.g. trained_models/training_run_*/fine_tuned_best_model.pt) into a sorted list of files.
+    """
+    checkpoints = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            raise RuntimeError(f"{pattern} file not found")
+        checkpoints.extend(matches)
+    return checkpoints
+
+
+def file_fingerprint(filename: str) -> str:
+    """
+    returns the sha1 hex digest of a file or of all files in a directory (e.g. a pair store).
+    """
+    if os.path.isdir(filename):
+        files = sorted(
+            os.path.join(filename, f)
+            for f in os.listdir(filename)
+            if os.path.isfile(os.path.join(filename, f))
+        )
+    else:
+        files = [filename]
+    sha1 = hashlib.sha1()
+    for f in files:
+        with open(f, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+def quantize_model(model: GINPairV1) -> torch.nn.Module:
+    """
+    returns a copy of the model with dynamically quantized (int8) Linear layers.
+    """
+    return torch.ao.quantization.quantize_dynamic(
+        model.cpu(), {torch.nn.Linear}, dtype=torch.qint8, inplace=False
+    )
+
+
+def prepare_model(model: GINPairV1, variant: str) -> torch.nn.Module:
+    """
+    turns an eager model into the requested variant for inference.
+    """
+    if variant == "eager":
+        return model
+    elif variant == "int8":
+        return quantize_model(model)
+    elif variant == "compiled":
+        try:
+            # without this check a missing inductor backend only fails on the first batch
+            import torch._inductor  # noqa: F401
+        except Exception as e:
+            raise RuntimeError(f"model variant compiled is not available: {e}") from e
+        # shapes change with every batch of graphs
+        return torch.compile(model, dynamic=True)
+    else:
+        raise RuntimeError(f"unknown model variant {variant}, use one of {VARIANTS}")
+
+
+def load_model(checkpoint_file: str, device=DEVICE) -> GINPairV1:
+    """
+    loads a GINPairV1 checkpoint and puts the model in evaluation mode.
+    Checkpoints exported by 09_export_models.py with int8 weights are loaded on the CPU.
+    """
+    model = GINPairV1(
+        num_node_features, num_edge_features, hidden_channels=hidden_channels
+    )
+    checkpoint = torch.load(checkpoint_file, map_location="cpu")
+    if checkpoint.get("variant") == "int8":
+        model.eval()
+        model = quantize_model(model)
+        device = torch.device("cpu")
+    model.load_state_dict(checkpoint["model_state_dict"])
+    model.to(device=device)
+    model.eval()
+    return model
+
+
+def collate_pairs(pairs: list) -> tuple:
+    """
+    batches PairData objects and keeps their identifiers outside of the batch.
+    meta contains (chembl_id, internal_id, reaction_center, smiles_prop, smiles_deprop) for every pair.
+    """
+    meta = [
+        (
+            pair.chembl_id,
+            ",".join(str(i) for i in pair.internal_id),
+            pair.reaction_center,
+            pair.smiles_prop,
+            pair.smiles_deprop,
+        )
+        for pair in pairs
+    ]
+    return Batch.from_data_list(pairs, follow_batch=["x_p", "x_d"]), meta
+
+
+def make_prediction_loader(
+    dataset, batch_size: int, num_workers: int = 0
+) -> torch.utils.data.DataLoader:
+    """
+    returns a DataLoader that keeps the order of dataset and yields (batch, meta) tuples.
+    """
+    return torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        collate_fn=collate_pairs,
+        num_workers=num_workers,
+    )
+
+
+def model_device(model: torch.nn.Module) -> torch.device:
+    """
+    returns the device of the model parameters (quantized models have no float parameters).
+    """
+    for parameter in model.parameters():
+        return parameter.device
+    return torch.device("cpu")
+
+
+def predict_batch(models: list, batch) -> np.ndarray:
+    """
+    returns the predicted pKa values of every model for a batch, shape: (nr_of_models, batch_size).
+    """
+    batch = batch.to(device=model_device(models[0]))
+    predictions = np.empty((len(models), batch.num_graphs), dtype=np.float32)
+    with torch.inference_mode():
+        for i, model in enumerate(models):
+            y_pred = model(
+                x_p=batch.x_p,
+                x_d=batch.x_d,
+                edge_attr_p=batch.edge_attr_p,
+                edge_attr_d=batch.edge_attr_d,
+                data=batch,
+            ).reshape(-1)
+            predictions[i] = y_pred.cpu().numpy()
+    return predictions
+
+
+def open_pyg_data(filename: str):
+    """
+    returns the PairData objects of a pyg pkl file or a pair store, memory-mapped.
+    A pkl file is converted to a pair store next to it on first use (see pair_store.open_pair_store),
+    unpickling it would hold the whole data set in memory.
+    """
+    return open_pair_store(filename)
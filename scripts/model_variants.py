@@ -0,0 +1,6 @@
+# model variants available for inference (see inference.prepare_model)
+# eager: the model as trained
+# int8: Linear layers dynamically quantized to int8 (CPU only)
+# compiled: the model compiled with torch.compile
+# kept free of torch imports so that command line parsers can use it
+VARIANTS = ["eager", "int8", "compiled"]
@@ -0,0 +1,211 @@
+import os
+import pickle
+
+import numpy as np
+
+# a mol store is a directory with one file per column (one row per protonation pair):
+# mol_prot, mol_deprot: RDKit binary (Mol.ToBinary) of the molecules, without properties
+# chembl_id, internal_id_prot, internal_id_deprot, smiles_prot, smiles_deprot: utf-8 strings
+# reaction_center (int32), pka (float64)
+# entry_offsets.npy: first pair of each chembl id entry (+ number of pairs)
+# extras.pkl: the remaining per entry lists (smiles_list, counter_list)
+# Byte and string columns are stored as <name>.bin (concatenated) and <name>.offsets.npy.
+BYTES_COLUMNS = [
+    "mol_prot",
+    "mol_deprot",
+    "chembl_id",
+    "internal_id_prot",
+    "internal_id_deprot",
+    "smiles_prot",
+    "smiles_deprot",
+]
+STRING_COLUMNS = BYTES_COLUMNS[2:]
+NUMERIC_COLUMNS = {"reaction_center": np.int32, "pka": np.float64}
+
+
+def _write_bytes_column(path: str, name: str, values: list):
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(v) for v in values])
+    with open(os.path.join(path, f"{name}.bin"), "wb") as fh:
+        for v in values:
+            fh.write(v)
+    np.save(os.path.join(path, f"{name}.offsets.npy"), offsets)
+
+
+def write_mol_store(entries: dict, path: str):
+    """
+    writes the dict of chembl_id: {"mols", "pKa_list", ...} generated by
+    04_1_split_epik_output.py/04_2_prepare_rest.py to a mol store.
+    """
+    from rdkit import Chem
+
+    os.makedirs(path, exist_ok=True)
+    columns = {name: [] for name in BYTES_COLUMNS + list(NUMERIC_COLUMNS)}
+    entry_offsets = [0]
+    extras = []
+    for entry in entries.values():
+        for (mol_prot, mol_deprot), pka in zip(entry["mols"], entry["pKa_list"]):
+            columns["mol_prot"].append(
+                mol_prot.ToBinary(Chem.PropertyPickleOptions.NoProps)
+            )
+            columns["mol_deprot"].append(
+                mol_deprot.ToBinary(Chem.PropertyPickleOptions.NoProps)
+            )
+            columns["chembl_id"].append(mol_prot.GetProp("CHEMBL_ID").encode())
+            columns["internal_id_prot"].append(mol_prot.GetProp("INTERNAL_ID").encode())
+            columns["internal_id_deprot"].append(
+                mol_deprot.GetProp("INTERNAL_ID").encode()
+            )
+            columns["smiles_prot"].append(mol_prot.GetProp("mol-smiles").encode())
+            columns["smiles_deprot"].append(mol_deprot.GetProp("mol-smiles").encode())
+            columns["reaction_center"].append(int(mol_prot.GetProp("epik_atom")))
+            columns["pka"].append(float(pka))
+        entry_offsets.append(entry_offsets[-1] + len(entry["mols"]))
+        extras.append(
+            {
+                key: value
+                for key, value in entry.items()
+                if key not in ("mols", "pKa_list")
+            }
+        )
+
+    for name in BYTES_COLUMNS:
+        _write_bytes_column(path, name, columns[name])
+    for name, dtype in NUMERIC_COLUMNS.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.array(columns[name], dtype=dtype))
+    np.save(
+        os.path.join(path, "entry_offsets.npy"), np.array(entry_offsets, dtype=np.int64)
+    )
+    with open(os.path.join(path, "extras.pkl"), "wb") as fh:
+        pickle.dump(extras, fh)
+
+
+def record_to_mols(record: tuple) -> tuple:
+    """
+    turns a record of MolStore.get_record back into a pair of mols with their properties
+    and the pKa value.
+    """
+    from rdkit import Chem
+
+    (
+        mol_prot,
+        mol_deprot,
+        chembl_id,
+        internal_id_prot,
+        internal_id_deprot,
+        smiles_prot,
+        smiles_deprot,
+        reaction_center,
+        pka,
+    ) = record
+    mols = []
+    for blob, internal_id, smiles in (
+        (mol_prot, internal_id_prot, smiles_prot),
+        (mol_deprot, internal_id_deprot, smiles_deprot),
+    ):
+        mol = Chem.Mol(blob)
+        mol.SetProp("CHEMBL_ID", chembl_id)
+        mol.SetProp("INTERNAL_ID", internal_id)
+        mol.SetProp("mol-smiles", smiles)
+        mol.SetProp("epik_atom", str(reaction_center))
+        mol.SetProp("pKa", str(pka))
+        mols.append(mol)
+    return tuple(mols), pka
+
+
+class MolStore:
+    """
+    memory-mapped, read-only view of a mol store.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.columns = {}
+        self.offsets = {}
+        for name in BYTES_COLUMNS:
+            self.offsets[name] = np.load(
+                os.path.join(path, f"{name}.offsets.npy"), mmap_mode="r"
+            )
+            if self.offsets[name][-1] > 0:
+                self.columns[name] = np.memmap(
+                    os.path.join(path, f"{name}.bin"), dtype=np.uint8, mode="r"
+                )
+            else:
+                # empty files can not be memory-mapped
+                self.columns[name] = np.zeros(0, dtype=np.uint8)
+        for name in NUMERIC_COLUMNS:
+            self.columns[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.entry_offsets = np.load(os.path.join(path, "entry_offsets.npy"))
+
+    def __len__(self) -> int:
+        """
+        number of pairs
+        """
+        return len(self.columns["pka"])
+
+    @property
+    def nr_of_entries(self) -> int:
+        return len(self.entry_offsets) - 1
+
+    def _get_bytes(self, name: str, idx: int) -> bytes:
+        offsets = self.offsets[name]
+        return self.columns[name][offsets[idx] : offsets[idx + 1]].tobytes()
+
+    def get_record(self, idx: int) -> tuple:
+        """
+        returns the pair at idx as tuple of bytes, strings and numbers (cheap to pickle).
+        """
+        return (
+            self._get_bytes("mol_prot", idx),
+            self._get_bytes("mol_deprot", idx),
+            *(self._get_bytes(name, idx).decode() for name in STRING_COLUMNS),
+            int(self.columns["reaction_center"][idx]),
+            float(self.columns["pka"][idx]),
+        )
+
+    def get_entry_records(self, entry_idx: int) -> list:
+        return [
+            self.get_record(idx)
+            for idx in range(
+                self.entry_offsets[entry_idx], self.entry_offsets[entry_idx + 1]
+            )
+        ]
+
+    def to_dict(self) -> dict:
+        """
+        returns the content in the format of the legacy pkl files:
+        chembl_id: {"mols": [(mol_prot, mol_deprot), ...], "pKa_list": [...], ...}
+        """
+        with open(os.path.join(self.path, "extras.pkl"), "rb") as fh:
+            extras = pickle.load(fh)
+        entries = {}
+        for entry_idx, extra in enumerate(extras):
+            pairs = [record_to_mols(r) for r in self.get_entry_records(entry_idx)]
+            chembl_id = pairs[0][0][0].GetProp("CHEMBL_ID")
+            entries[chembl_id] = {
+                "mols": [mols for mols, _ in pairs],
+                "pKa_list": [pka for _, pka in pairs],
+                **extra,
+            }
+        return entries
+
+
+def save_intermediate(entries: dict, filename: str):
+    """
+    saves the output of 04_1/04_2: .pkl files are pickled, everything else is written as mol store.
+    """
+    if filename.endswith(".pkl"):
+        with open(filename, "wb+") as fh:
+            pickle.dump(entries, fh)
+    else:
+        write_mol_store(entries, filename)
+
+
+def load_intermediate(filename: str) -> dict:
+    """
+    loads the output of 04_1/04_2 from a pkl file or a mol store.
+    """
+    if os.path.isdir(filename):
+        return MolStore(filename).to_dict()
+    with open(filename, "rb") as fh:
+        return pickle.load(fh)
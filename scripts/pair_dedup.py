@@ -0,0 +1,151 @@
+import csv
+
+import numpy as np
+
+# keep-first: the first occurrence of a pair is kept
+# average: the first occurrence is kept with the mean pKa of all occurrences
+# drop-conflicting: pairs whose pKa values differ by more than the tolerance are removed,
+#                   otherwise the first occurrence is kept
+DEDUP_POLICIES = ["keep-first", "average", "drop-conflicting"]
+
+REPORT_COLUMNS = [
+    "reason",
+    "action",
+    "chembl_ids",
+    "internal_ids",
+    "pka_values",
+    "smiles_prot",
+    "smiles_deprot",
+    "reaction_center_rank",
+]
+
+
+def pair_key(mol_prot, mol_deprot, atom_idx: int) -> tuple:
+    """
+    returns an atom order independent key of a protonation pair:
+    canonical SMILES of both molecules and the canonical rank of the reaction center.
+    Symmetry equivalent reaction centers share a rank.
+    """
+    from rdkit import Chem
+
+    ranks = Chem.CanonicalRankAtoms(mol_prot, breakTies=False)
+    return (
+        Chem.MolToSmiles(mol_prot),
+        Chem.MolToSmiles(mol_deprot),
+        int(ranks[int(atom_idx)]),
+    )
+
+
+def select_pairs(entry: dict, keep: list) -> dict:
+    """
+    returns a copy of an entry (mols, pKa_list, ...) that only contains the pairs at the indices in keep.
+    Only lists with one element per pair are filtered.
+    """
+    nr_of_pairs = len(entry["mols"])
+    return {
+        key: [value[i] for i in keep]
+        if isinstance(value, list) and len(value) == nr_of_pairs
+        else value
+        for key, value in entry.items()
+    }
+
+
+def merge_entries(entry: dict, other: dict) -> dict:
+    """
+    appends the pairs of other to entry (used for repeated chembl ids).
+    """
+    return {
+        key: value + other[key] if isinstance(value, list) else value
+        for key, value in entry.items()
+    }
+
+
+class PairIndex:
+    """
+    hash index over (pair canonical SMILES, reaction center) that finds
+    identical protonation pairs across chembl ids and resolves them with a policy.
+    Everything that is changed is written to the report instead of aborting the run.
+    """
+
+    def __init__(self, policy: str = "keep-first", tolerance: float = 0.5):
+        if policy not in DEDUP_POLICIES:
+            raise RuntimeError(f"unknown policy {policy}, use one of {DEDUP_POLICIES}")
+        self.policy = policy
+        self.tolerance = tolerance
+        self.report = []
+
+    def report_repeated_chembl_id(self, chembl_id: str, entry: dict):
+        self.report.append(
+            [
+                "repeated_chembl_id",
+                "merged",
+                chembl_id,
+                "",
+                ",".join(str(p) for p in entry["pKa_list"]),
+                "",
+                "",
+                "",
+            ]
+        )
+
+    def deduplicate(self, entries: dict) -> dict:
+        """
+        takes the dict of chembl_id: entry (mols, pKa_list, ...) and returns it without duplicated pairs.
+        """
+        index = {}
+        for chembl_id, entry in entries.items():
+            for i, (mol_prot, mol_deprot) in enumerate(entry["mols"]):
+                key = pair_key(mol_prot, mol_deprot, mol_prot.GetProp("epik_atom"))
+                index.setdefault(key, []).append((chembl_id, i))
+
+        keep = {chembl_id: set() for chembl_id in entries}
+        new_pka = {}
+        for key, occurrences in index.items():
+            pkas = np.array(
+                [float(entries[c]["pKa_list"][i]) for c, i in occurrences]
+            )
+            first_chembl_id, first_idx = occurrences[0]
+            if len(occurrences) == 1:
+                keep[first_chembl_id].add(first_idx)
+                continue
+
+            conflicting = pkas.max() - pkas.min() > self.tolerance
+            if self.policy == "drop-conflicting" and conflicting:
+                action = "dropped"
+            else:
+                keep[first_chembl_id].add(first_idx)
+                action = "kept_first"
+                if self.policy == "average":
+                    new_pka[(first_chembl_id, first_idx)] = float(pkas.mean())
+                    action = "averaged"
+            self.report.append(
+                [
+                    "conflicting_pka" if conflicting else "duplicate",
+                    action,
+                    ",".join(c for c, _ in occurrences),
+                    ",".join(
+                        entries[c]["mols"][i][0].GetProp("INTERNAL_ID")
+                        for c, i in occurrences
+                    ),
+                    ",".join(f"{p:.2f}" for p in pkas),
+                    *key,
+                ]
+            )
+
+        for (chembl_id, i), pka in new_pka.items():
+            entry = entries[chembl_id]
+            entry["pKa_list"][i] = pka
+            for mol in entry["mols"][i]:
+                mol.SetProp("pKa", str(pka))
+
+        deduplicated = {}
+        for chembl_id, entry in entries.items():
+            if keep[chembl_id]:
+                deduplicated[chembl_id] = select_pairs(entry, sorted(keep[chembl_id]))
+        return deduplicated
+
+    def write_report(self, filename: str):
+        with open(filename, "w", newline="") as fh:
+            writer = csv.writer(fh, delimiter="\t")
+            writer.writerow(REPORT_COLUMNS)
+            writer.writerows(self.report)
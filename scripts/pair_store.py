@@ -0,0 +1,220 @@
+import argparse
+import fcntl
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+# a pair store is a directory with two files:
+# data.bin: the pickled PairData objects written back to back
+# offsets.npy: int64 array with the start of each object in data.bin (+ end of the last one)
+DATA_FILE = "data.bin"
+OFFSETS_FILE = "offsets.npy"
+
+
+class PairStoreWriter:
+    """
+    appends pickled objects to a pair store.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.offsets = [0]
+        self.fh = open(os.path.join(path, DATA_FILE), "wb")
+
+    def append(self, obj):
+        self.append_bytes(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def append_bytes(self, blob: bytes):
+        self.fh.write(blob)
+        self.offsets.append(self.offsets[-1] + len(blob))
+
+    def close(self):
+        self.fh.close()
+        np.save(
+            os.path.join(self.path, OFFSETS_FILE), np.array(self.offsets, dtype=np.int64)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PairStore:
+    """
+    memory-mapped, read-only view of a pair store.
+    Objects are only unpickled when they are accessed.
+    Can be used as map-style dataset of a torch DataLoader.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self._data = None
+
+    @property
+    def data(self):
+        # the mmap is opened lazily so that the store can be send to DataLoader workers
+        if self._data is None:
+            with open(os.path.join(self.path, DATA_FILE), "rb") as fh:
+                if os.fstat(fh.fileno()).st_size == 0:
+                    self._data = b""
+                else:
+                    self._data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get_bytes(self, idx: int) -> bytes:
+        return self.data[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def __getitem__(self, idx: int):
+        return pickle.loads(self.get_bytes(idx))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+class BatchStream:
+    """
+    endless stream of the batches of a DataLoader: iter() continues where the previous
+    iterator stopped and a new pass (e.g. with a new shuffle) is started when one is used up.
+    Drawing next(iter(stream)) every training step walks through the whole data set
+    instead of starting a new pass (and shuffling all indices) for a single batch.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.iterator = None
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.iterator is not None:
+            try:
+                return next(self.iterator)
+            except StopIteration:
+                pass
+        self.iterator = iter(self.loader)
+        return next(self.iterator)
+
+
+def write_pair_store(pairs, path: str):
+    """
+    writes an iterable of PairData objects to a pair store at path.
+    """
+    with PairStoreWriter(path) as writer:
+        for pair in pairs:
+            writer.append(pair)
+
+
+def replace_pair_store(pairs, path: str):
+    """
+    writes a pair store to a temporary directory and moves it to path.
+    An existing store is replaced, not overwritten, so processes that have it
+    memory-mapped keep reading the old files.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    name = os.path.basename(os.path.abspath(path))
+    # unique per call, concurrent writers of the same store do not delete each other's files
+    tmp_path = tempfile.mkdtemp(prefix=f"{name}.tmp.", dir=parent)
+    try:
+        write_pair_store(pairs, tmp_path)
+        # mkdtemp only gives the owner access
+        os.chmod(tmp_path, 0o755)
+        if os.path.isdir(path):
+            # renaming onto the empty directory made by mkdtemp keeps the name unique
+            old_path = tempfile.mkdtemp(prefix=f"{name}.old.", dir=parent)
+            os.replace(path, old_path)
+            shutil.rmtree(old_path)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # another process has put its complete store in place in the meantime
+            if not os.path.isdir(path):
+                raise
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def store_path_for(pkl_file: str) -> str:
+    """
+    returns the pair store path that belongs to a pyg pkl file.
+    """
+    return f"{os.path.splitext(pkl_file)[0]}.store"
+
+
+def is_current_store(path: str, pkl_file: str) -> bool:
+    """
+    returns True if the pair store at path exists and is not older than the pkl file.
+    """
+    return os.path.isdir(path) and os.path.getmtime(path) >= os.path.getmtime(pkl_file)
+
+
+def open_pair_store(filename: str) -> PairStore:
+    """
+    opens a pair store. If filename is a pyg pkl file the store next to it is used
+    and generated from the pkl file if it does not exist yet or is older than the pkl file.
+    """
+    if os.path.isdir(filename):
+        return PairStore(filename)
+    path = store_path_for(filename)
+    if is_current_store(path, filename):
+        return PairStore(path)
+    # processes started together (e.g. fine tuning runs sharing --reg) convert the pkl file
+    # one after the other, the later ones find the store of the first one
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not is_current_store(path, filename):
+            print(f"generating pair store {path} from {filename}")
+            with open(filename, "rb") as fh:
+                pairs = pickle.load(fh)
+            # written to a temporary directory first so that an interrupted run leaves no partial store
+            replace_pair_store(pairs, path)
+    return PairStore(path)
+
+
+def main():
+    """
+    takes a pkl file of pytorch geometric graph data and writes it to a memory-mapped pair store.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", help="input filename, type: .pkl")
+    parser.add_argument(
+        "--output", default="", help="output directory (default: <input>.store)"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="rewrite the output if it already exists"
+    )
+    args = parser.parse_args()
+    output = args.output or store_path_for(args.input)
+    print("inputfile:", args.input)
+    print("outputfile:", output)
+    if os.path.isdir(output) and not args.force:
+        print(f"{output} already exists, use --force to rewrite it")
+        return
+    with open(args.input, "rb") as fh:
+        pairs = pickle.load(fh)
+    replace_pair_store(pairs, output)
+    print(f"{len(pairs)} PairData objects written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+
+import numpy as np
+from rdkit import Chem
+from torch_geometric.data import Batch
+
+from inference import predict_batch
+
+
+def canonical_smiles(smiles: str) -> str:
+    """
+    returns the RDKit canonical SMILES, or the input if it can not be parsed.
+    """
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return smiles
+    return Chem.MolToSmiles(mol)
+
+
+# rounds of color refinement for reaction_center_classes
+REFINEMENT_ROUNDS = 8
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    """
+    splitmix64 finalizer, scrambles an array of uint64 hashes (arithmetic wraps around).
+    """
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def _row_hashes(values: np.ndarray) -> np.ndarray:
+    """
+    returns a uint64 hash of every row of a feature matrix that only depends on the row content.
+    """
+    words = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+    h = np.full(len(words), words.shape[1], dtype=np.uint64)
+    for column in words.T:
+        h = _mix(h ^ column.astype(np.uint64))
+    return h
+
+
+def reaction_center_classes(
+    x: np.ndarray,
+    edge_index: np.ndarray,
+    edge_attr: np.ndarray,
+    centers: np.ndarray,
+    rounds: int = REFINEMENT_ROUNDS,
+) -> np.ndarray:
+    """
+    returns an atom order independent class (uint64) for every node in centers.
+    Node hashes are refined with the hashes of their neighbors and bonds (Weisfeiler-Lehman),
+    so symmetry equivalent atoms share a class, like the canonical ranks in pair_dedup.pair_key.
+    Works on batched graphs, every node only sees its own molecule.
+    """
+    colors = _row_hashes(x)
+    bond_colors = _row_hashes(edge_attr)
+    source, target = edge_index
+    for _ in range(rounds):
+        neighbors = np.zeros_like(colors)
+        np.add.at(neighbors, target, _mix(colors[source] ^ bond_colors))
+        colors = _mix(colors ^ _mix(neighbors))
+    return colors[centers]
+
+
+def pair_key(
+    smiles_prot: str, smiles_deprot: str, center_class, model_fingerprint: str
+) -> str:
+    """
+    returns the cache key of a protonation pair predicted with a model (or ensemble).
+    center_class is the reaction center class returned by reaction_center_classes;
+    the raw reaction center index depends on the atom order of the input file.
+    """
+    key = "\t".join(
+        [
+            canonical_smiles(smiles_prot),
+            canonical_smiles(smiles_deprot),
+            f"{int(center_class):016x}",
+            model_fingerprint,
+        ]
+    )
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def ensemble_fingerprint(checkpoint_fingerprints: list, variant: str = "eager") -> str:
+    """
+    returns a fingerprint for an ordered list of checkpoints used with a model variant.
+    """
+    sha1 = hashlib.sha1(variant.encode())
+    for fingerprint in checkpoint_fingerprints:
+        sha1.update(fingerprint.encode())
+    return sha1.hexdigest()
+
+
+class PredictionCache:
+    """
+    two tier cache for predictions: an in-memory LRU tier in front of an optional
+    SQLite tier on disk. Values are float32 arrays (one pKa per ensemble member).
+    Both tiers evict the least recently used entries when they are full.
+    """
+
+    def __init__(
+        self,
+        path: str = "",
+        max_memory_items: int = 100_000,
+        max_disk_items: int = 0,
+    ):
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.memory = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.puts_since_evict = 0
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed)"
+            )
+            self.db.commit()
+
+    def _remember(self, key: str, value: np.ndarray):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys: list) -> list:
+        """
+        returns the cached value for every key, None for keys that are not cached.
+        """
+        values = [None] * len(keys)
+        missing = {}
+        for i, key in enumerate(keys):
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                values[i] = value
+            else:
+                missing.setdefault(key, []).append(i)
+
+        if self.db is not None and missing:
+            found = []
+            missing_keys = list(missing)
+            # stay below the sqlite limit of host parameters
+            for start in range(0, len(missing_keys), 500):
+                chunk = missing_keys[start : start + 500]
+                found.extend(
+                    self.db.execute(
+                        f"SELECT key, value FROM predictions WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                )
+            now = time.time()
+            self.db.executemany(
+                "UPDATE predictions SET accessed = ? WHERE key = ?",
+                [(now, key) for key, _ in found],
+            )
+            for key, blob in found:
+                value = np.frombuffer(blob, dtype=np.float32)
+                self._remember(key, value)
+                for i in missing.pop(key):
+                    values[i] = value
+                    self.disk_hits += 1
+
+        self.misses += sum(len(idx) for idx in missing.values())
+        return values
+
+    def put_many(self, items: list):
+        """
+        adds (key, value) tuples to the cache. The disk tier is evicted on the way,
+        it holds at most 10% more than max_disk_items.
+        """
+        items = [(key, np.asarray(value, dtype=np.float32)) for key, value in items]
+        for key, value in items:
+            self._remember(key, value)
+        if self.db is not None:
+            now = time.time()
+            self.db.executemany(
+                "INSERT OR REPLACE INTO predictions (key, value, accessed) VALUES (?, ?, ?)",
+                [(key, value.tobytes(), now) for key, value in items],
+            )
+            self.db.commit()
+            # counting the rows is a table scan, evict after every tenth of max_disk_items
+            self.puts_since_evict += len(items)
+            if self.max_disk_items and self.puts_since_evict * 10 >= self.max_disk_items:
+                self.evict()
+
+    def evict(self):
+        """
+        removes the least recently used entries from the disk tier if it holds more than max_disk_items.
+        """
+        if self.db is None or not self.max_disk_items:
+            return
+        self.puts_since_evict = 0
+        (nr_of_items,) = self.db.execute("SELECT COUNT(*) FROM predictions").fetchone()
+        if nr_of_items > self.max_disk_items:
+            self.db.execute(
+                "DELETE FROM predictions WHERE key IN "
+                "(SELECT key FROM predictions ORDER BY accessed LIMIT ?)",
+                (nr_of_items - self.max_disk_items,),
+            )
+            self.db.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def stats(self) -> str:
+        return (
+            f"cache hit rate: {self.hit_rate:.1%} "
+            f"(memory: {self.memory_hits}, disk: {self.disk_hits}, misses: {self.misses})"
+        )
+
+    def close(self):
+        if self.db is not None:
+            self.evict()
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+
+def predict_with_cache(
+    models: list, batch, meta: list, cache: PredictionCache, model_fingerprint: str
+) -> np.ndarray:
+    """
+    same as inference.predict_batch, but only pairs that are not in the cache are predicted.
+    meta is the list of pair identifiers returned by inference.collate_pairs.
+    """
+    # reaction_center indexes the atoms of its own graph, x_p of the batch stacks all graphs
+    nodes_per_graph = np.bincount(batch.x_p_batch.numpy(), minlength=len(meta))
+    offsets = np.cumsum(nodes_per_graph) - nodes_per_graph
+    classes = reaction_center_classes(
+        batch.x_p.numpy(),
+        batch.edge_index_p.numpy(),
+        batch.edge_attr_p.numpy(),
+        offsets + np.array([int(reaction_center) for _, _, reaction_center, _, _ in meta]),
+    )
+    keys = [
+        pair_key(smiles_prop, smiles_deprop, center_class, model_fingerprint)
+        for (_, _, _, smiles_prop, smiles_deprop), center_class in zip(meta, classes)
+    ]
+    cached = cache.get_many(keys)
+    predictions = np.empty((len(models), len(meta)), dtype=np.float32)
+    missing = []
+    for i, value in enumerate(cached):
+        if value is None:
+            missing.append(i)
+        else:
+            predictions[:, i] = value
+
+    if missing:
+        if len(missing) < len(meta):
+            batch = Batch.from_data_list(
+                batch.index_select(missing), follow_batch=["x_p", "x_d"]
+            )
+        predictions[:, missing] = predict_batch(models, batch)
+        cache.put_many([(keys[i], predictions[:, i]) for i in missing])
+    return predictions
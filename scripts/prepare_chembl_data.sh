@@ -16,6 +16,6 @@ python ${dir_path}/03_convert_mae_to_sdf.py --input ${data_path}/02_chembl_datas
 #filter mols that are present in test sets
 python ${dir_path}/04_0_filter_testmols.py --input ${data_path}/03_chembl_dataset.sdf.gz  --output ${data_path}/04_chembl_dataset_filtered.sdf.gz --filter ${data_path}/00_AvLiLuMoVe_testdata.sdf,${data_path}/00_novartis_testdata.sdf
 # split mols in protonated/deprotonated pairs with pka values
-python ${dir_path}/04_1_split_epik_output.py --input ${data_path}/04_chembl_dataset_filtered.sdf.gz --output ${data_path}/04_chembl_dataset_pyg.pkl
+python ${dir_path}/04_1_split_epik_output.py --input ${data_path}/04_chembl_dataset_filtered.sdf.gz --output ${data_path}/04_chembl_dataset.mols
 # generate pyg input data
-python ${dir_path}/05_data_preprocess.py --input ${data_path}/04_chembl_dataset_pyg.pkl --output ${data_path}/05_chembl_dataset_pyg.pkl
\ No newline at end of file
+python ${dir_path}/05_data_preprocess.py --input ${data_path}/04_chembl_dataset.mols --output ${data_path}/05_chembl_dataset_pyg.pkl
\ No newline at end of file
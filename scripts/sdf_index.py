@@ -0,0 +1,339 @@
+import argparse
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from sdf_io import (
+    DEFAULT_BLOCK_SIZE,
+    BlockCompressedWriter,
+    add_writer_arguments,
+    decompress_block,
+    index_path,
+    open_sdf_input,
+    read_frame_index,
+    sniff_codec,
+)
+
+# the record index is stored next to the sdf file as <filename>.records.npz:
+# block: block of the frame index (-1 if the file has no frame index)
+# offset, length: position of the record in the decompressed block (or in the decompressed file)
+# key: value of the key property (the title line if the property is missing)
+# size, mtime: of the indexed file, used to detect outdated indices
+RECORD_END = re.compile(rb"^\$\$\$\$[^\n]*(?:\n|$)", re.MULTILINE)
+
+
+def record_index_path(filename: str) -> str:
+    return f"{filename}.records.npz"
+
+
+def record_key(record: bytes, key: str) -> str:
+    """
+    returns the value of the data field key of an SDF record, or its title line.
+    """
+    match = re.search(
+        rb"^>[^\n]*<" + re.escape(key.encode()) + rb">[^\n]*\n([^\n]*)",
+        record,
+        re.MULTILINE,
+    )
+    if match is None:
+        return record.split(b"\n", 1)[0].strip().decode(errors="replace")
+    return match.group(1).strip().decode(errors="replace")
+
+
+def iter_records(fh, chunk_size: int = DEFAULT_BLOCK_SIZE):
+    """
+    yields (offset, record) for all complete records of a (decompressed) binary stream.
+    The stream is read in chunks, the incomplete last record of a chunk is carried over
+    to the next one, so memory stays at about chunk_size plus the longest record.
+    """
+    offset = 0
+    rest = b""
+    while True:
+        chunk = fh.read(chunk_size)
+        data = rest + chunk
+        start = 0
+        for match in RECORD_END.finditer(data):
+            # a $$$$ line at the end of the chunk may continue in the next one
+            if chunk and match.end() == len(data) and not data.endswith(b"\n"):
+                break
+            yield offset + start, data[start : match.end()]
+            start = match.end()
+        if not chunk:
+            # data after the last $$$$ line is not a complete record and is ignored
+            break
+        offset += start
+        rest = data[start:]
+
+
+def find_records(data: bytes, key: str) -> tuple:
+    """
+    returns offsets, lengths and keys of all records in data.
+    Data after the last $$$$ line is not a complete record and is ignored.
+    """
+    offsets, lengths, keys = [], [], []
+    start = 0
+    for match in RECORD_END.finditer(data):
+        offsets.append(start)
+        lengths.append(match.end() - start)
+        keys.append(record_key(data[start : match.end()], key))
+        start = match.end()
+    return offsets, lengths, keys
+
+
+def file_stat(filename: str) -> tuple:
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_frame_index(filename: str):
+    """
+    returns the frame index of a block compressed file, None if there is none or
+    if it does not match the file (e.g. the file was overwritten by another writer).
+    """
+    if not os.path.exists(index_path(filename)):
+        return None
+    frame_index = read_frame_index(filename)
+    end = frame_index[-1, 0] + frame_index[-1, 1] if len(frame_index) else 0
+    if end != os.path.getsize(filename):
+        return None
+    return frame_index
+
+
+def build_index(filename: str, key: str = "chembl_id", threads: int = 4) -> dict:
+    """
+    scans an SDF file and writes the record index. Block compressed files (with frame index)
+    are scanned block by block in parallel, plain files in chunks.
+    Other compressed files are decompressed sequentially in chunks, reading records from them
+    later on needs sequential decompression as well.
+    """
+    codec = sniff_codec(filename)
+    blocks, offsets, lengths, keys = [], [], [], []
+    frame_index = load_frame_index(filename)
+    if frame_index is not None:
+
+        def scan_block(block: int) -> tuple:
+            offset, size = frame_index[block, :2]
+            with open(filename, "rb") as fh:
+                fh.seek(int(offset))
+                data = decompress_block(fh.read(int(size)), codec)
+            return find_records(data, key)
+
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+            for block, (o, l, k) in enumerate(
+                executor.map(scan_block, range(len(frame_index)))
+            ):
+                blocks.extend([block] * len(o))
+                offsets.extend(o)
+                lengths.extend(l)
+                keys.extend(k)
+    else:
+        if codec != "none":
+            print(
+                f"{filename} has no frame index, records can only be read by decompressing "
+                "the file up to them. Use --convert to write a block compressed copy.",
+                file=sys.stderr,
+            )
+        with open_sdf_input(filename) as fh:
+            for offset, record in iter_records(fh):
+                offsets.append(offset)
+                lengths.append(len(record))
+                keys.append(record_key(record, key))
+        blocks = [-1] * len(offsets)
+
+    index = {
+        "block": np.array(blocks, dtype=np.int64),
+        "offset": np.array(offsets, dtype=np.int64),
+        "length": np.array(lengths, dtype=np.int64),
+        "key": np.array(keys, dtype=str),
+        "key_name": np.array(key),
+        "stat": np.array(file_stat(filename), dtype=np.int64),
+    }
+    np.savez(record_index_path(filename), **index)
+    return index
+
+
+class SDFIndex:
+    """
+    random access to the records of a (plain, gzip or zstd compressed) SDF file.
+    The record index is built on first use and rebuilt if the file changed.
+    Record i is read with one seek (plain files) or by decompressing its block
+    (block compressed files written by sdf_io); the last block is cached.
+    """
+
+    def __init__(self, filename: str, key: str = "chembl_id", threads: int = 4):
+        self.filename = filename
+        index = None
+        if os.path.exists(record_index_path(filename)):
+            index = dict(np.load(record_index_path(filename)))
+            if (
+                str(index["key_name"]) != key
+                or tuple(index["stat"]) != file_stat(filename)
+            ):
+                index = None
+        if index is None:
+            index = build_index(filename, key, threads)
+        self.block = index["block"]
+        self.offset = index["offset"]
+        self.length = index["length"]
+        self.key = index["key"]
+        self.codec = sniff_codec(filename)
+        self.frame_index = load_frame_index(filename)
+        self._key_lookup = None
+        self._cached_block = (None, b"")
+        self._fh = None
+
+    def __len__(self) -> int:
+        return len(self.offset)
+
+    def __getstate__(self):
+        # the open file handle is not shared with worker processes
+        state = self.__dict__.copy()
+        state["_fh"] = None
+        state["_cached_block"] = (None, b"")
+        return state
+
+    def _file(self):
+        if self._fh is None:
+            if self.frame_index is None and self.codec != "none":
+                self._fh = open_sdf_input(self.filename)
+            else:
+                self._fh = open(self.filename, "rb")
+        return self._fh
+
+    def _read_block(self, block: int) -> bytes:
+        if self._cached_block[0] != block:
+            offset, size = self.frame_index[block, :2]
+            fh = self._file()
+            fh.seek(int(offset))
+            self._cached_block = (block, decompress_block(fh.read(int(size)), self.codec))
+        return self._cached_block[1]
+
+    def get_bytes(self, idx: int) -> bytes:
+        """
+        returns the SDF record idx (including the $$$$ line).
+        """
+        block, offset, length = self.block[idx], self.offset[idx], self.length[idx]
+        if block < 0:
+            fh = self._file()
+            fh.seek(int(offset))
+            return fh.read(int(length))
+        return self._read_block(int(block))[offset : offset + length]
+
+    def get_range(self, start: int, stop: int) -> bytes:
+        """
+        returns the records start to stop-1 as one SDF text.
+        """
+        return b"".join(self.get_bytes(idx) for idx in range(start, stop))
+
+    def get_mol(self, idx: int, removeHs: bool = True):
+        from rdkit import Chem
+
+        return next(
+            Chem.ForwardSDMolSupplier(io.BytesIO(self.get_bytes(idx)), removeHs=removeHs)
+        )
+
+    def get_mols(self, start: int, stop: int, removeHs: bool = True) -> list:
+        from rdkit import Chem
+
+        return list(
+            Chem.ForwardSDMolSupplier(
+                io.BytesIO(self.get_range(start, stop)), removeHs=removeHs
+            )
+        )
+
+    def find(self, key: str) -> list:
+        """
+        returns the numbers of all records with the key (e.g. a chembl_id).
+        """
+        if self._key_lookup is None:
+            self._key_lookup = {}
+            for idx, k in enumerate(self.key):
+                self._key_lookup.setdefault(str(k), []).append(idx)
+        return self._key_lookup.get(key, [])
+
+    def chunks(self, chunk_size: int) -> list:
+        """
+        returns (start, stop) record ranges of about chunk_size records for parallel processing.
+        Chunks of block compressed files end at block boundaries, so every block
+        is decompressed by only one worker.
+        """
+        if self.frame_index is None or not len(self):
+            return [
+                (start, min(start + chunk_size, len(self)))
+                for start in range(0, len(self), chunk_size)
+            ]
+        # first record of every block
+        block_starts = np.searchsorted(self.block, np.arange(len(self.frame_index)))
+        chunks = []
+        start = 0
+        for block_start in block_starts[1:]:
+            if block_start - start >= chunk_size:
+                chunks.append((start, int(block_start)))
+                start = int(block_start)
+        chunks.append((start, len(self)))
+        return chunks
+
+
+def convert(filename: str, output: str, codec: str, level: int, threads: int):
+    """
+    writes a block compressed copy (with frame index) of an SDF file,
+    the input is read and decompressed in chunks.
+    """
+    with open_sdf_input(filename) as fh, BlockCompressedWriter(
+        output, codec, level, threads, DEFAULT_BLOCK_SIZE
+    ) as writer:
+        for _, record in iter_records(fh):
+            writer.write(record)
+            writer.end_record()
+
+
+def main():
+    """
+    builds the record index of an SDF file (plain, gzip or zstd compressed) and
+    prints single records selected by number or key property (e.g. a chembl_id).
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", help="input filename, type: .sdf.gz, .sdf.zst or .sdf")
+    parser.add_argument(
+        "--key",
+        default="chembl_id",
+        help="data field used as record key (default=chembl_id, title line if missing)",
+    )
+    parser.add_argument(
+        "--record", type=int, nargs="*", default=[], help="print records by number"
+    )
+    parser.add_argument(
+        "--get", nargs="*", default=[], help="print all records with these keys"
+    )
+    parser.add_argument(
+        "--convert",
+        default="",
+        help="write a block compressed copy with frame index to this filename",
+    )
+    add_writer_arguments(parser)
+    args = parser.parse_args()
+    print("inputfile:", args.input, file=sys.stderr)
+
+    if args.convert:
+        convert(args.input, args.convert, args.codec, args.level, args.threads)
+        print(f"block compressed copy written to {args.convert}", file=sys.stderr)
+        return
+
+    index = SDFIndex(args.input, args.key, args.threads)
+    print(f"{len(index)} records indexed", file=sys.stderr)
+    records = list(args.record)
+    for key in args.get:
+        found = index.find(key)
+        if not found:
+            print(f"{args.key} {key} not found", file=sys.stderr)
+        records.extend(found)
+    for idx in records:
+        sys.stdout.write(index.get_bytes(idx).decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import gzip
+import io
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# block compressed files are a sequence of independent gzip members or zstd frames,
+# each containing complete SDF records. Concatenated gzip members are a valid gzip file
+# and concatenated zstd frames a valid zstd file, so every gzip/zstd reader can read them.
+# The frame index is stored next to the file as <filename>.idx (numpy array, one row per block):
+# compressed offset, compressed size, uncompressed offset, uncompressed size,
+# number of the first record, number of records
+CODECS = ["gzip", "zstd", "none"]
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3, "none": 0}
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+INDEX_COLUMNS = [
+    "offset",
+    "size",
+    "raw_offset",
+    "raw_size",
+    "first_record",
+    "nr_of_records",
+]
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _import_zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("the zstd codec requires the zstandard package")
+    return zstandard
+
+
+def codec_for(filename: str) -> str:
+    """
+    returns the codec implied by the file extension (.gz, .zst or anything else).
+    """
+    if filename.endswith(".gz"):
+        return "gzip"
+    elif filename.endswith(".zst"):
+        return "zstd"
+    return "none"
+
+
+def index_path(filename: str) -> str:
+    return f"{filename}.idx"
+
+
+def sniff_codec(filename: str) -> str:
+    """
+    returns the codec of a file from its magic bytes.
+    """
+    with open(filename, "rb") as fh:
+        magic = fh.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    elif magic.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return "none"
+
+
+def compress_block(data: bytes, codec: str, level: int) -> bytes:
+    """
+    compresses data to a single gzip member or zstd frame.
+    zlib and zstandard release the GIL, so blocks are compressed in parallel by threads.
+    """
+    if codec == "gzip":
+        # wbits=31: zlib stream with gzip header and trailer
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    elif codec == "zstd":
+        return _import_zstd().ZstdCompressor(level=level).compress(data)
+    elif codec == "none":
+        return data
+    raise RuntimeError(f"unknown codec {codec}, use one of {CODECS}")
+
+
+def decompress_block(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return zlib.decompress(data, 31)
+    elif codec == "zstd":
+        return _import_zstd().ZstdDecompressor().decompress(data)
+    elif codec == "none":
+        return data
+    raise RuntimeError(f"unknown codec {codec}, use one of {CODECS}")
+
+
+class BlockCompressedWriter:
+    """
+    file-like object that collects complete records into blocks of about block_size bytes
+    and compresses the blocks in a thread pool. Blocks are written in order and
+    listed in the frame index (<filename>.idx) when the writer is closed.
+    Call end_record() after every record, blocks are only cut at record boundaries.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        codec: str = "",
+        level: int = None,
+        threads: int = 4,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ):
+        self.filename = filename
+        self.codec = codec or codec_for(filename)
+        if self.codec not in CODECS:
+            raise RuntimeError(f"unknown codec {self.codec}, use one of {CODECS}")
+        if self.codec == "zstd":
+            _import_zstd()
+        self.level = DEFAULT_LEVELS[self.codec] if level is None else level
+        self.block_size = block_size
+        self.threads = max(1, threads)
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.fh = open(filename, "wb")
+        self.buffer = []
+        self.buffer_size = 0
+        self.nr_of_records = 0
+        self.block_records = 0
+        self.raw_offset = 0
+        self.index = []
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        return len(data)
+
+    def end_record(self):
+        self.nr_of_records += 1
+        self.block_records += 1
+        if self.buffer_size >= self.block_size:
+            self._submit_block()
+
+    def _submit_block(self):
+        if not self.buffer_size:
+            return
+        data = b"".join(self.buffer)
+        self.buffer = []
+        self.buffer_size = 0
+        first_record = self.nr_of_records - self.block_records
+        self.pending.append(
+            (
+                self.executor.submit(compress_block, data, self.codec, self.level),
+                self.raw_offset,
+                len(data),
+                first_record,
+                self.block_records,
+            )
+        )
+        self.raw_offset += len(data)
+        self.block_records = 0
+        # keep at most two blocks per thread in memory
+        while len(self.pending) > 2 * self.threads:
+            self._write_block()
+
+    def _write_block(self):
+        future, raw_offset, raw_size, first_record, nr_of_records = self.pending.popleft()
+        block = future.result()
+        self.index.append(
+            (self.fh.tell(), len(block), raw_offset, raw_size, first_record, nr_of_records)
+        )
+        self.fh.write(block)
+
+    def close(self):
+        if self.fh is None:
+            return
+        self._submit_block()
+        while self.pending:
+            self._write_block()
+        self.executor.shutdown()
+        self.fh.close()
+        self.fh = None
+        with open(index_path(self.filename), "wb") as fh:
+            np.save(fh, np.array(self.index, dtype=np.int64).reshape(-1, len(INDEX_COLUMNS)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SDFWriter:
+    """
+    Chem.SDWriter on top of a BlockCompressedWriter, one record per mol.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        codec: str = "",
+        level: int = None,
+        threads: int = 4,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ):
+        from rdkit import Chem
+
+        self.stream = BlockCompressedWriter(filename, codec, level, threads, block_size)
+        # the SDWriter only accepts text streams, every record is formatted into a StringIO
+        self.record = io.StringIO()
+        self.writer = Chem.SDWriter(self.record)
+
+    def write(self, mol):
+        self.writer.write(mol)
+        self.writer.flush()
+        self.stream.write(self.record.getvalue())
+        self.stream.end_record()
+        self.record.seek(0)
+        self.record.truncate()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_sdf_input(filename: str):
+    """
+    opens a plain, gzip or zstd compressed file for binary reading (e.g. for Chem.ForwardSDMolSupplier).
+    The codec is detected from the magic bytes, not from the file extension.
+    """
+    codec = sniff_codec(filename)
+    if codec == "gzip":
+        return gzip.open(filename, "rb")
+    elif codec == "zstd":
+        return _import_zstd().ZstdDecompressor().stream_reader(
+            open(filename, "rb"), read_across_frames=True, closefd=True
+        )
+    return open(filename, "rb")
+
+
+def read_frame_index(filename: str) -> np.ndarray:
+    """
+    returns the frame index written by BlockCompressedWriter (columns: INDEX_COLUMNS).
+    """
+    with open(index_path(filename), "rb") as fh:
+        return np.load(fh)
+
+
+def read_block(filename: str, frame_index: np.ndarray, block: int, codec: str = "") -> bytes:
+    """
+    returns the decompressed content of a block; blocks can be read independently,
+    e.g. by different processes.
+    """
+    codec = codec or sniff_codec(filename)
+    offset, size = frame_index[block, :2]
+    with open(filename, "rb") as fh:
+        fh.seek(int(offset))
+        return decompress_block(fh.read(int(size)), codec)
+
+
+def add_writer_arguments(parser, default_threads: int = 4):
+    """
+    adds the --codec, --level and --threads options of SDF outputs to an argparse parser.
+    """
+    parser.add_argument(
+        "--codec",
+        default="",
+        choices=[""] + CODECS,
+        help="compression of the output (default: from the file extension, .gz: gzip, .zst: zstd)",
+    )
+    parser.add_argument(
+        "--level",
+        type=int,
+        default=None,
+        help=f"compression level (default: gzip {DEFAULT_LEVELS['gzip']}, zstd {DEFAULT_LEVELS['zstd']})",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=default_threads,
+        help=f"compression threads (default={default_threads})",
+    )
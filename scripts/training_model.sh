@@ -9,5 +9,6 @@ data_path=${dir_path}/..
 
 # start with pretraining on the CHEMBL data
 python ${dir_path}/06_training.py --input ${data_path}/05_chembl_dataset_pyg.pkl --path ${data_path}/trained_models/training_run_${run} --epoch 1000
-# transfer learning on the experimental data
+# transfer learning on the experimental data,
+# the CHEMBL data is converted once into a memory-mapped pair store (05_chembl_dataset_pyg.store) for regularization
 python ${dir_path}/06_training.py --input ${data_path}/05_experimental_training_datasets_pyg.pkl --path ${data_path}/trained_models/training_run_${run} -r --epoch 1000 --reg ${data_path}/05_chembl_dataset_pyg.pkl